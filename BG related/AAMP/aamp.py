@@ -1,5 +1,6 @@
 # Code provided by Kinnay
 from parser_ import Parser, Struct
+from stream import StreamIn
 import binascii
 import enum
 import sys
@@ -19,6 +20,53 @@ class ParamType(enum.IntEnum):
 	CURVE = 12
 
 
+def hash_name(name):
+	"""Returns the crc32 hash of a name, or the name itself if it already is a hash"""
+	if isinstance(name, int): return name
+	if isinstance(name, str): name = name.encode("ascii")
+	return binascii.crc32(name)
+
+
+class LazyChildren:
+	"""
+	Children of a lazily loaded node. Only their offsets and hashes are
+	read up front; each child is decoded the first time it's accessed.
+	"""
+
+	def __init__(self, stream, count, cls):
+		self.data = stream.data
+		self.endian = stream.endian
+		self.cls = cls
+		self.offsets = []
+		self.children = {}
+		
+		hashes = []
+		for i in range(count):
+			self.offsets.append(stream.tell())
+			hashes.append(cls.scan(stream))
+			
+		#One dictionary per kind of hash, from hash to child positions
+		self.indexes = [{} for kind in hashes[0]] if hashes else []
+		for i, child_hashes in enumerate(hashes):
+			for index, hash in zip(self.indexes, child_hashes):
+				index.setdefault(hash, []).append(i)
+				
+	def __len__(self):
+		return len(self.offsets)
+		
+	def get(self, i):
+		if i not in self.children:
+			stream = StreamIn(self.data, self.offsets[i], self.endian)
+			self.children[i] = self.cls.from_stream(stream, lazy=True)
+		return self.children[i]
+		
+	def find(self, hash, kind=0):
+		return [self.get(i) for i in self.indexes[kind].get(hash, [])] if self.indexes else []
+		
+	def all(self):
+		return [self.get(i) for i in range(len(self.offsets))]
+
+
 class Color(Struct):
 	fields = (
 		("r", "float"),
@@ -75,7 +123,18 @@ class Param(Parser):
 		self.name_hash = 0
 		self.value = None
 
-	def load(self, stream):
+	@classmethod
+	def scan(cls, stream):
+		"""Skips a param, returning its name hash"""
+		stream.u32() #Size
+		type = stream.u32()
+		name_hash = stream.u32()
+		if type not in cls.sizes:
+			raise ValueError("Param type %i" %type)
+		stream.skip(cls.sizes[type])
+		return (name_hash,)
+
+	def load(self, stream, lazy=False):
 		stream.u32() #Size
 		self.type = stream.u32()
 		self.name_hash = stream.u32()
@@ -132,16 +191,54 @@ class ParamObj(Parser):
 		self.name_hash = 0
 		self.group_hash = 0
 		self.params = []
+		
+	@property
+	def params(self):
+		if self.lazy_params is not None:
+			self._params = self.lazy_params.all()
+			self.lazy_params = None
+		return self._params
+		
+	@params.setter
+	def params(self, params):
+		self._params = params
+		self.lazy_params = None
+		
+	def get_param(self, name):
+		"""Returns the param with the given name or hash, or None"""
+		hash = hash_name(name)
+		if self.lazy_params is not None:
+			params = self.lazy_params.find(hash)
+			return params[0] if params else None
+		
+		for param in self._params:
+			if param.name_hash == hash:
+				return param
+				
+	@classmethod
+	def scan(cls, stream):
+		"""Skips an object, returning its name and group hashes"""
+		start = stream.tell()
+		size = stream.u32()
+		stream.u32() #Number of params
+		name_hash = stream.u32()
+		group_hash = stream.u32()
+		stream.seek(start + size)
+		return (name_hash, group_hash)
 
-	def load(self, stream):
+	def load(self, stream, lazy=False):
 		stream.u32() #Size
 		num_params = stream.u32()
 		self.name_hash = stream.u32()
 		self.group_hash = stream.u32()
 		
-		self.params = []
-		for i in range(num_params):
-			self.params.append(Param.from_stream(stream))
+		if lazy:
+			self._params = None
+			self.lazy_params = LazyChildren(stream, num_params, Param)
+		else:
+			self.params = []
+			for i in range(num_params):
+				self.params.append(Param.from_stream(stream))
 			
 	def save(self, stream):
 		substream = stream.new()
@@ -163,19 +260,87 @@ class ParamList(Parser):
 		self.name_hash = 0
 		self.lists = []
 		self.objs = []
+		
+	@property
+	def lists(self):
+		if self.lazy_lists is not None:
+			self._lists = self.lazy_lists.all()
+			self.lazy_lists = None
+		return self._lists
+		
+	@lists.setter
+	def lists(self, lists):
+		self._lists = lists
+		self.lazy_lists = None
+		
+	@property
+	def objs(self):
+		if self.lazy_objs is not None:
+			self._objs = self.lazy_objs.all()
+			self.lazy_objs = None
+		return self._objs
+		
+	@objs.setter
+	def objs(self, objs):
+		self._objs = objs
+		self.lazy_objs = None
+		
+	def get_list(self, name):
+		"""Returns the list with the given name or hash, or None"""
+		hash = hash_name(name)
+		if self.lazy_lists is not None:
+			lists = self.lazy_lists.find(hash)
+			return lists[0] if lists else None
+		
+		for list in self._lists:
+			if list.name_hash == hash:
+				return list
+				
+	def get_obj(self, name):
+		"""Returns the object with the given name or hash, or None"""
+		hash = hash_name(name)
+		if self.lazy_objs is not None:
+			objs = self.lazy_objs.find(hash)
+			return objs[0] if objs else None
+		
+		for obj in self._objs:
+			if obj.name_hash == hash:
+				return obj
+				
+	def get_group(self, group):
+		"""Returns the objects with the given group name or hash"""
+		hash = hash_name(group)
+		if self.lazy_objs is not None:
+			return self.lazy_objs.find(hash, 1)
+		return [obj for obj in self._objs if obj.group_hash == hash]
+		
+	@classmethod
+	def scan(cls, stream):
+		"""Skips a list, returning its name hash"""
+		start = stream.tell()
+		size = stream.u32()
+		name_hash = stream.u32()
+		stream.seek(start + size)
+		return (name_hash,)
 
-	def load(self, stream):
+	def load(self, stream, lazy=False):
 		stream.u32() #Size
 		self.name_hash = stream.u32()
 		num_lists = stream.u32()
 		num_objs = stream.u32()
 		
-		self.lists = []
-		self.objs = []
-		for i in range(num_lists):
-			self.lists.append(ParamList.from_stream(stream))
-		for i in range(num_objs):
-			self.objs.append(ParamObj.from_stream(stream))
+		if lazy:
+			self._lists = None
+			self._objs = None
+			self.lazy_lists = LazyChildren(stream, num_lists, ParamList)
+			self.lazy_objs = LazyChildren(stream, num_objs, ParamObj)
+		else:
+			self.lists = []
+			self.objs = []
+			for i in range(num_lists):
+				self.lists.append(ParamList.from_stream(stream))
+			for i in range(num_objs):
+				self.objs.append(ParamObj.from_stream(stream))
 			
 	def save(self, stream):
 		substream = stream.new()
@@ -201,7 +366,11 @@ class AAMPFile(Parser):
 		self.param_root = ParamList.new()
 		self.param_root.name_hash = binascii.crc32(b"param_root")
 
-	def load(self, stream):
+	def load(self, stream, lazy=False):
+		"""
+		If lazy is True, lists, objects and params are only decoded when
+		they are accessed. Saving decodes everything that's left.
+		"""
 		stream.set_endian("<")
 
 		if stream.ascii(4) != "AAMP": return self.ERROR
@@ -212,7 +381,7 @@ class AAMPFile(Parser):
 		stream.u32() #Type length
 		self.type = stream.string()
 		
-		self.param_root = ParamList.from_stream(stream)
+		self.param_root = ParamList.from_stream(stream, lazy=lazy)
 		
 	def save(self, stream):
 		stream.set_endian("<")
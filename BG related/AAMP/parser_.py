@@ -11,25 +11,25 @@ class Parser:
 		return instance
 
 	@classmethod
-	def from_stream(cls, stream):
+	def from_stream(cls, stream, **kwargs):
 		instance = cls()
-		if instance.load(stream) != cls.ERROR:
+		if instance.load(stream, **kwargs) != cls.ERROR:
 			return instance
 		
 	@classmethod
-	def from_data(cls, data, endian=">"):
+	def from_data(cls, data, endian=">", **kwargs):
 		instance = cls()
-		if instance.load_data(data, endian) != cls.ERROR:
+		if instance.load_data(data, endian, **kwargs) != cls.ERROR:
 			return instance
 		
 	@classmethod
-	def from_file(cls, filename, endian=">"):
+	def from_file(cls, filename, endian=">", **kwargs):
 		with open(filename, "rb") as f:
-			return cls.from_data(f.read(), endian)
+			return cls.from_data(f.read(), endian, **kwargs)
 			
-	def load_data(self, data, endian=">"):
+	def load_data(self, data, endian=">", **kwargs):
 		stream = StreamIn(data, endian=endian)
-		return self.load(stream)
+		return self.load(stream, **kwargs)
 			
 	def to_data(self, endian=">"):
 		stream = StreamOut(endian=endian)
@@ -1,5 +1,9 @@
+from instrument import Span
+from items import TrackedList, ZoneIndex
+from objlayer import ObjectLayer
 import SarcLib
 import struct
+import yaz0
 
 
 class Game:
@@ -19,10 +23,34 @@ class Game:
             Class for a parsed NSMBU level area
             """
 
+            # Blocks that have to be saved again when one of these attributes is set
+            # (the zones also decide the zone IDs of the entrances and sprites)
+            ATTR_BLOCKS = {
+                'tileset0': (0,), 'tileset1': (0,), 'tileset2': (0,), 'tileset3': (0,),
+                'startEntrance': (1,), 'unk1': (1,), 'unk2': (1,), 'wrapedges': (1,), 'timelimit': (1,),
+                'unk3': (1,), 'unk4': (1,), 'unk5': (1,), 'unk6': (1,), 'timelimit2': (1,), 'timelimit3': (1,),
+                'entrances': (6,),
+                'sprites': (7, 8),
+                'zones': (2, 4, 6, 7, 9),
+                'locations': (10,),
+                'pathdata': (13, 14),
+                'nPathdata': (13, 14),
+            }
+
+            # Lists whose changes are tracked when they are TrackedLists
+            LIST_ATTRS = ('entrances', 'sprites', 'zones', 'locations', 'pathdata')
+
+            # Blocks packed by save(), the others are saved as they are in self.blocks
+            PARSED_BLOCKS = (1, 2, 4, 6, 7, 8, 9, 10, 13, 14)
+
             def __init__(self):
                 """
                 Creates a completely new NSMBW area
                 """
+                # Blocks that changed since the last save, and the blocks from it
+                self.dirtyBlocks = set(range(15))
+                self.blockCache = None
+
                 # Default area number
                 self.areanum = 1
 
@@ -49,18 +77,21 @@ class Game:
                 self.timelimit3 = 0
 
                 # Lists of things
-                self.entrances = []
-                self.sprites = []
+                self.entrances = TrackedList()
+                self.sprites = TrackedList()
                 self.bounding = []
                 self.bgs = []
-                self.zones = []
-                self.locations = []
-                self.pathdata = []
+                self.zones = TrackedList()
+                self.locations = TrackedList()
+                self.pathdata = TrackedList()
                 self.nPathdata = []
                 self.paths = []
                 self.nPaths = []
                 self.comments = []
-                self.layers = [[], [], []]
+                self.layers = [TrackedList(), TrackedList(), TrackedList()]
+
+                # Zone lookup grid, built by save()
+                self.zoneIndex = None
 
                 # BG data
                 self.bgCount = 1
@@ -70,11 +101,58 @@ class Game:
                 self.bgblockid.append(bg[0])
                 self.bgs[bg[0]] = bg
 
+            def __setattr__(self, name, value):
+                object.__setattr__(self, name, value)
+
+                if name in self.ATTR_BLOCKS:
+                    self.dirtyBlocks.update(self.ATTR_BLOCKS[name])
+
+                elif name == 'layers':
+                    # (layer, saved layer) of the last save
+                    self.layerCache = [None] * 3
+
+            def MarkDirty(self, *names):
+                """
+                Makes the next save() pack the given attributes again (e.g. 'sprites'),
+                for when the items in them were changed in place.
+                Without names, everything is packed again.
+                """
+                if not names:
+                    self.dirtyBlocks.update(range(15))
+                    self.layerCache = [None] * 3
+
+                for name in names:
+                    if name == 'layers':
+                        self.layerCache = [None] * 3
+
+                    else:
+                        self.dirtyBlocks.update(self.ATTR_BLOCKS[name])
+
+            def DirtyBlocks(self):
+                """
+                Returns the set of blocks that changed since the last save
+                """
+                if self.blockCache is None:
+                    return set(range(15))
+
+                dirty = set(self.dirtyBlocks)
+                for name in self.LIST_ATTRS:
+                    value = getattr(self, name)
+                    if not isinstance(value, TrackedList) or value.dirty:
+                        dirty.update(self.ATTR_BLOCKS[name])
+
+                return dirty
+
             @staticmethod
             def MapPositionToZoneID(zones, x, y, useid=False):
                 """
-                Returns the zone ID containing or nearest the specified position
+                Returns the zone ID containing or nearest the specified position.
+                zones can also be a ZoneIndex, which is much faster for many positions.
                 """
+                if isinstance(zones, ZoneIndex):
+                    index, id = zones.lookup(x, y)
+                    return id if useid or index == -1 else index
+
                 id = 0
                 minimumdist = -1
                 rval = -1
@@ -104,61 +182,135 @@ class Game:
 
             def save(self):
                 """
-                Save the area back to a file
+                Save the area back to a file.
+                Only the blocks that changed since the last save are packed again.
                 """
+                dirty = self.DirtyBlocks()
+
+                # Every sprite and entrance needs its zone, so index the zones once
+                if self.zoneIndex is None or 9 in dirty:
+                    self.zoneIndex = ZoneIndex(self.zones)
+
                 # Prepare this first because otherwise the game refuses to load some sprites
-                self.SortSpritesByZone()
+                if 7 in dirty:
+                    self.SortSpritesByZone()
+
+                # The tileset names are tiny, but their size depends on the names
+                if 0 in dirty:
+                    self.SaveTilesetNames()  # block 1
+
+                # Save the metadata, padded to 4 bytes
+                rdata = self.Metadata.save()
+                rsize = (len(rdata) + 3) & ~3
+
+                # Work out where every block goes, then pack them all
+                # straight into one buffer for the main course file
+                sizes = self.BlockSizes(dirty)
+                offsets = []
+                FileOffset = (15 * 8) + rsize
+                for blocksize in sizes:
+                    offsets.append(FileOffset)
+                    FileOffset += blocksize
 
-                # We don't parse blocks 4, 6, 12, 13
-                # Save the other blocks
-                self.SaveTilesetNames()  # block 1
-                self.SaveOptions()  # block 2
-                self.SaveEntrances()  # block 7
-                self.SaveSprites()  # block 8
-                self.SaveLoadedSprites()  # block 9
-                self.SaveZones()  # blocks 10, 3, and 5
-                self.SaveLocations()  # block 11
-                self.SavePaths()  # blocks 14 and 15
-
-                # Save the metadata
-                rdata = bytearray(self.Metadata.save())
-                if len(rdata) % 4 != 0:
-                    for i in range(4 - (len(rdata) % 4)):
-                        rdata.append(0)
-                rdata = bytes(rdata)
-
-                # Save the main course file
-                # We'll be passing over the blocks array two times.
-                # Using bytearray here because it offers mutable bytes
-                # and works directly with struct.pack_into(), so it's a
-                # win-win situation
-                FileLength = (15 * 8) + len(rdata)
-                for block in self.blocks:
-                    FileLength += len(block)
-
-                course = bytearray()
-                for i in range(FileLength): course.append(0)
+                course = bytearray(FileOffset)
                 saveblock = struct.Struct('>II')
+                for i in range(15):
+                    saveblock.pack_into(course, i * 8, offsets[i], sizes[i])
 
-                HeaderOffset = 0
-                FileOffset = (15 * 8) + len(rdata)
-                struct.pack_into('{0}s'.format(len(rdata)), course, 0x78, rdata)
-                for block in self.blocks:
-                    blocksize = len(block)
-                    saveblock.pack_into(course, HeaderOffset, FileOffset, blocksize)
-                    if blocksize > 0:
-                        course[FileOffset:FileOffset + blocksize] = block
-                    HeaderOffset += 8
-                    FileOffset += blocksize
+                course[0x78:0x78 + len(rdata)] = rdata
+
+                # We don't parse blocks 4, 6, 12, 13
+                # Copy them, and block 1, as they are
+                for i in (0, 3, 5, 11, 12):
+                    course[offsets[i]:offsets[i] + sizes[i]] = self.blocks[i]
+
+                # Copy the blocks that didn't change from the last save
+                for i in self.PARSED_BLOCKS:
+                    if i not in dirty:
+                        course[offsets[i]:offsets[i] + sizes[i]] = self.blockCache[i]
+
+                # Save the other blocks
+                if 1 in dirty:
+                    self.SaveOptions(course, offsets[1])  # block 2
+                if 6 in dirty:
+                    self.SaveEntrances(course, offsets[6])  # block 7
+                if 7 in dirty:
+                    self.SaveSprites(course, offsets[7])  # block 8
+                if 8 in dirty:
+                    self.SaveLoadedSprites(course, offsets[8])  # block 9
+                if 9 in dirty:
+                    self.SaveZones(course, offsets[9], offsets[2], offsets[4])  # blocks 10, 3, and 5
+                if 10 in dirty:
+                    self.SaveLocations(course, offsets[10])  # block 11
+                if 13 in dirty:
+                    self.SavePaths(course, offsets[13], offsets[14])  # blocks 14 and 15
+
+                # The blocks are kept as views of the course file
+                course = memoryview(course).toreadonly()
+                self.blockCache = [course[offsets[i]:offsets[i] + sizes[i]] for i in range(15)]
+                self.blocks = list(self.blockCache)
+
+                # Everything is saved now
+                self.dirtyBlocks.clear()
+                for name in self.LIST_ATTRS:
+                    value = getattr(self, name)
+                    if isinstance(value, TrackedList):
+                        value.dirty = False
 
                 # Return stuff
                 return (
-                    bytes(course),
-                    self.SaveLayer(0),
-                    self.SaveLayer(1),
-                    self.SaveLayer(2),
+                    course,
+                    self.SaveLayerCached(0),
+                    self.SaveLayerCached(1),
+                    self.SaveLayerCached(2),
                 )
 
+            def BlockSizes(self, dirty=None):
+                """
+                Returns the sizes of the 15 blocks, worked out from the record counts.
+                Blocks 1, 4, 6, 12 and 13 are saved as they are in self.blocks.
+                If dirty is given, the blocks not in it keep their size from the last save.
+                """
+                sizes = [len(block) for block in self.blocks]
+
+                if dirty is None or self.blockCache is None:
+                    dirty = range(15)
+
+                else:
+                    for i in self.PARSED_BLOCKS:
+                        if i not in dirty:
+                            sizes[i] = len(self.blockCache[i])
+
+                if 1 in dirty:
+                    sizes[1] = 0x18
+                if 9 in dirty:
+                    zonesize = 28 * len(self.zones)
+                    sizes[2] = zonesize
+                    sizes[4] = zonesize
+                    sizes[9] = zonesize
+                if 6 in dirty:
+                    sizes[6] = 24 * len(self.entrances)
+                if 7 in dirty:
+                    sizes[7] = (24 * len(self.sprites)) + 4
+                if 8 in dirty:
+                    sizes[8] = 4 * len(set(sprite.type for sprite in self.sprites))
+                if 10 in dirty:
+                    sizes[10] = 12 * len(self.locations)
+
+                if 13 in dirty:
+                    pathcount = len(self.pathdata)
+                    nodecount = 0
+                    for path in self.pathdata:
+                        nodecount += len(path['nodes'])
+                    if self.nPathdata:
+                        pathcount += 1
+                        nodecount += len(self.nPathdata['nodes'])
+
+                    sizes[13] = pathcount * 12
+                    sizes[14] = nodecount * 20
+
+                return sizes
+
             def SortSpritesByZone(self):
                 """
                 Sorts the sprite list by zone ID so it will work in-game
@@ -167,11 +319,13 @@ class Game:
                 split = {}
                 zones = []
 
-                f_MapPositionToZoneID = self.MapPositionToZoneID
-                zonelist = self.zones
+                if self.zoneIndex is None:
+                    self.zoneIndex = ZoneIndex(self.zones)
 
-                for sprite in self.sprites:
-                    zone = f_MapPositionToZoneID(zonelist, sprite.objx, sprite.objy)
+                results = self.zoneIndex.lookupAll([(sprite.objx, sprite.objy) for sprite in self.sprites])
+
+                for sprite, (index, id) in zip(self.sprites, results):
+                    zone = id if index == -1 else index
                     sprite.zoneID = zone
                     if not zone in split:
                         split[zone] = []
@@ -183,7 +337,7 @@ class Game:
                 for z in zones:
                     newlist += split[z]
 
-                self.sprites = newlist 
+                self.sprites = TrackedList(newlist)
 
             def SaveTilesetNames(self):
                 """
@@ -193,15 +347,13 @@ class Game:
                     [self.tileset0.ljust(32, '\0'), self.tileset1.ljust(32, '\0'), self.tileset2.ljust(32, '\0'),
                      self.tileset3.ljust(32, '\0')]).encode('utf-8')
 
-            def SaveOptions(self):
+            def SaveOptions(self, buffer, offset):
                 """
-                Saves block 2, the general options
+                Saves block 2, the general options, to buffer at offset
                 """
                 optstruct = struct.Struct('>xxBBxxxxxBHxBBBBxxBHH')
-                buffer = bytearray(0x18)
-                optstruct.pack_into(buffer, 0, self.unk1, self.unk2, self.wrapedges, self.timelimit, self.unk3, self.unk4,
+                optstruct.pack_into(buffer, offset, self.unk1, self.unk2, self.wrapedges, self.timelimit, self.unk3, self.unk4,
                                     self.unk5, self.startEntrance, self.unk6, self.timelimit2, self.timelimit3)
-                self.blocks[1] = bytes(buffer)
 
             def SaveLayer(self, idx):
                 """
@@ -210,6 +362,9 @@ class Game:
                 layer = self.layers[idx]
                 if not layer: return None
 
+                if isinstance(layer, ObjectLayer):
+                    return layer.saveNSMBU()
+
                 offset = 0
                 objstruct = struct.Struct('>HhhHHB')
                 buffer = bytearray((len(layer) * 16) + 2)
@@ -226,16 +381,31 @@ class Game:
                     offset += 16
                 buffer[offset] = 0xFF
                 buffer[offset + 1] = 0xFF
-                return bytes(buffer)
+                return buffer
 
-            def SaveEntrances(self):
+            def SaveLayerCached(self, idx):
                 """
-                Saves the entrances back to block 7
+                Saves an object layer like SaveLayer, but returns the
+                result of the last save if the layer is an unchanged TrackedList
+                """
+                layer = self.layers[idx]
+                cached = self.layerCache[idx]
+                if cached is not None and cached[0] is layer and isinstance(layer, TrackedList) and not layer.dirty:
+                    return cached[1]
+
+                data = self.SaveLayer(idx)
+                self.layerCache[idx] = (layer, data)
+                if isinstance(layer, TrackedList):
+                    layer.dirty = False
+
+                return data
+
+            def SaveEntrances(self, buffer, offset):
+                """
+                Saves the entrances back to block 7, in buffer at offset
                 """
-                offset = 0
                 entstruct = struct.Struct('>HHxBxxBBBBBBxBxBBBBBBx')
-                buffer = bytearray(len(self.entrances) * 24)
-                zonelist = self.zones
+                zonelist = self.zones if self.zoneIndex is None else self.zoneIndex
                 for entrance in self.entrances:
                     zoneID = self.MapPositionToZoneID(zonelist, entrance.objx, entrance.objy)
                     entstruct.pack_into(buffer, offset, int(entrance.objx), int(entrance.objy), int(entrance.unk05),
@@ -244,26 +414,13 @@ class Game:
                                         int(entrance.entsettings), int(entrance.unk12), int(entrance.camera),
                                         int(entrance.pathID), int(entrance.pathnodeindex), int(entrance.unk16))
                     offset += 24
-                self.blocks[6] = bytes(buffer)
 
-            def SavePaths(self):
+            def SavePaths(self, buffer, offset, nodeoffset):
                 """
-                Saves the paths back to block 14 and 15
+                Saves the paths back to block 14 and 15, in buffer at offset and nodeoffset
                 """
                 pathstruct = struct.Struct('>BbHHxBxxxx')
-                nodecount = 0
-                for path in self.pathdata:
-                    nodecount += len(path['nodes'])
-                if self.nPathdata:
-                    nodecount += len(self.nPathdata['nodes'])
-                nodebuffer = bytearray(nodecount * 20)
-                nodeoffset = 0
                 nodeindex = 0
-                offset = 0
-                pathcount = len(self.pathdata)
-                if self.nPathdata:
-                    pathcount += 1
-                buffer = bytearray(pathcount * 12)
 
                 nPathSaved = False
 
@@ -271,7 +428,7 @@ class Game:
                     if len(path['nodes']) < 1: continue
 
                     if path['id'] > 90 and not nPathSaved and self.nPathdata:
-                        self.WriteNabbitPathNodes(nodebuffer, nodeoffset, self.nPathdata['nodes'])
+                        self.WriteNabbitPathNodes(buffer, nodeoffset, self.nPathdata['nodes'])
 
                         pathstruct.pack_into(buffer, offset, 90, 0, int(nodeindex), int(len(self.nPathdata['nodes'])), 0)
                         offset += 12
@@ -280,7 +437,7 @@ class Game:
 
                         nPathSaved = True
 
-                    self.WritePathNodes(nodebuffer, nodeoffset, path['nodes'])
+                    self.WritePathNodes(buffer, nodeoffset, path['nodes'])
 
                     pathstruct.pack_into(buffer, offset, int(path['id']), 0, int(nodeindex), int(len(path['nodes'])),
                                          2 if path['loops'] else 0)
@@ -289,16 +446,13 @@ class Game:
                     nodeindex += len(path['nodes'])
 
                 if not nPathSaved and self.nPathdata:
-                    self.WriteNabbitPathNodes(nodebuffer, nodeoffset, self.nPathdata['nodes'])
+                    self.WriteNabbitPathNodes(buffer, nodeoffset, self.nPathdata['nodes'])
 
                     pathstruct.pack_into(buffer, offset, 90, 0, int(nodeindex), int(len(self.nPathdata['nodes'])), 0)
                     offset += 12
                     nodeoffset += len(self.nPathdata['nodes']) * 20
                     nodeindex += len(self.nPathdata['nodes'])
 
-                self.blocks[13] = bytes(buffer)
-                self.blocks[14] = bytes(nodebuffer)
-
             def WritePathNodes(self, buffer, offst, nodes):
                 """
                 Writes the path node data to the block 15 bytearray
@@ -323,19 +477,18 @@ class Game:
                                          0.0, int(node['action']), 0, 0, 0, 0)
                     offset += 20
 
-            def SaveSprites(self):
+            def SaveSprites(self, buffer, offset):
                 """
-                Saves the sprites back to block 8
+                Saves the sprites back to block 8, in buffer at offset
                 """
-                offset = 0
                 sprstruct = struct.Struct('>HHH10sBB3sxxx')
-                buffer = bytearray((len(self.sprites) * 24) + 4)
                 f_int = int
+                zonelist = self.zones if self.zoneIndex is None else self.zoneIndex
                 for sprite in self.sprites:
                     try:
                         sprstruct.pack_into(buffer, offset, f_int(sprite.type), f_int(sprite.objx), f_int(sprite.objy),
                                             sprite.spritedata[:10],
-                                            self.MapPositionToZoneID(self.zones, sprite.objx, sprite.objy, True), 0,
+                                            self.MapPositionToZoneID(zonelist, sprite.objx, sprite.objy, True), 0,
                                             sprite.spritedata[10:] + b'\0')
                     except struct.error:
                         # Hopefully this will solve the mysterious bug, and will
@@ -354,72 +507,57 @@ class Game:
                 buffer[offset + 1] = 0xFF
                 buffer[offset + 2] = 0xFF
                 buffer[offset + 3] = 0xFF
-                self.blocks[7] = bytes(buffer)
 
-            def SaveLoadedSprites(self):
+            def SaveLoadedSprites(self, buffer, offset):
                 """
-                Saves the list of loaded sprites back to block 9
+                Saves the list of loaded sprites back to block 9, in buffer at offset
                 """
                 ls = []
                 for sprite in self.sprites:
                     if sprite.type not in ls: ls.append(sprite.type)
                 ls.sort()
 
-                offset = 0
                 sprstruct = struct.Struct('>Hxx')
-                buffer = bytearray(len(ls) * 4)
                 for s in ls:
                     sprstruct.pack_into(buffer, offset, int(s))
                     offset += 4
-                self.blocks[8] = bytes(buffer)
 
-            def SaveZones(self):
+            def SaveZones(self, buffer, offset, bdngoffset, bgoffset):
                 """
-                Saves blocks 10, 3, and 5; the zone data, boundings, and background data respectively
+                Saves blocks 10, 3, and 5; the zone data, boundings, and background data respectively,
+                in buffer at offset, bdngoffset and bgoffset
                 """
                 bdngstruct = struct.Struct('>llllHHxxxxxxxx')
                 bgStruct = struct.Struct('>HxBxxxx16sHxx')
                 zonestruct = struct.Struct('>HHHHxBxBBBBBxBBxBxBBxBxx')
-                offset = 0
                 i = 0
-                zcount = len(self.zones)
-                buffer2 = bytearray(28 * zcount)
-                buffer4 = bytearray(28 * zcount)
-                buffer9 = bytearray(28 * zcount)
                 for z in self.zones:
-                    bdngstruct.pack_into(buffer2, offset, z.yupperbound, z.ylowerbound, z.yupperbound2, z.ylowerbound2, i,
+                    bdngstruct.pack_into(buffer, bdngoffset, z.yupperbound, z.ylowerbound, z.yupperbound2, z.ylowerbound2, i,
                                          z.unknownbnf)
-                    bgStruct.pack_into(buffer4, offset, z.id, z.background[1], z.background[2], z.background[3])
-                    zonestruct.pack_into(buffer9, offset,
+                    bgStruct.pack_into(buffer, bgoffset, z.id, z.background[1], z.background[2], z.background[3])
+                    zonestruct.pack_into(buffer, offset,
                                          z.objx, z.objy, z.width, z.height,
                                          0, 0, z.id, i,
                                          z.cammode, z.camzoom, z.visibility, z.id,
                                          z.camtrack, z.music, z.sfxmod, z.type)
                     offset += 28
+                    bdngoffset += 28
+                    bgoffset += 28
                     i += 1
 
-                self.blocks[2] = bytes(buffer2)
-                self.blocks[4] = bytes(buffer4)
-                self.blocks[9] = bytes(buffer9)
-
-            def SaveLocations(self):
+            def SaveLocations(self, buffer, offset):
                 """
-                Saves block 11, the location data
+                Saves block 11, the location data, in buffer at offset
                 """
                 locstruct = struct.Struct('>HHHHBxxx')
-                offset = 0
-                zcount = len(self.locations)
-                buffer = bytearray(12 * zcount)
-
                 for z in self.locations:
                     locstruct.pack_into(buffer, offset, int(z.objx), int(z.objy), int(z.width), int(z.height), int(z.id))
                     offset += 12
 
-                self.blocks[10] = bytes(buffer)
-
-        def save(self):
+        def save(self, compressLevel=None):
             """
-            Save the level back to a file
+            Save the level back to a file.
+            If compressLevel is given, the file is compressed to Yaz0 (SZS) at that level.
             """
 
             # Make a new archive
@@ -431,7 +569,11 @@ class Game:
 
             # Go through the areas, save them and add them back to the archive
             for areanum, area in enumerate(self.areas):
-                course, L0, L1, L2 = area.save()
+                with Span('area.save') as span:
+                    course, L0, L1, L2 = area.save()
+
+                    if span:
+                        span.count('bytes', sum(len(data) for data in (course, L0, L1, L2) if data is not None))
 
                 if course is not None:
                     courseFolder.addFile(SarcLib.File('course%d.bin' % (areanum + 1), course))
@@ -442,11 +584,20 @@ class Game:
                 if L2 is not None:
                     courseFolder.addFile(SarcLib.File('course%d_bgdatL2.bin' % (areanum + 1), L2))
 
-            outerArchive = SarcLib.SARC_Archive()
-            outerArchive.addFile(SarcLib.File('level', newArchive.save()[0]))
-            outerArchive.addFile(SarcLib.File('levelname', b'level'))
+            with Span('sarc.pack') as span:
+                outerArchive = SarcLib.SARC_Archive()
+                outerArchive.addFile(SarcLib.File('level', newArchive.save()[0]))
+                outerArchive.addFile(SarcLib.File('levelname', b'level'))
+
+                data = outerArchive.save()[0]
+                span.count('bytes', len(data))
+
+            if compressLevel is not None:
+                with Span('yaz0.compress') as span:
+                    data = yaz0.CompressYaz0(data, compressLevel)
+                    span.count('bytes', len(data))
 
-            return outerArchive.save()[0]
+            return data
 
     def __init__(self):
         self.level = self.Level()
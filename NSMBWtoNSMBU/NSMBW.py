@@ -1,5 +1,9 @@
 import archive
+from functools import partial
 from items import ObjectItem, ZoneItem, LocationItem, EntranceItem
+from instrument import Span
+import mmap
+import objlayer
 import os
 import pickle
 import struct
@@ -25,25 +29,48 @@ def checkContent(data):
     return True
 
 
-def IsNSMBLevel(filename):
+def PrepareLevelData(data):
     """
-    Does some basic checks to confirm a file is a NSMBW level
+    Decompresses level data if needed and does some basic checks to
+    confirm it's a NSMBW level. Returns the level data, or None.
+    """
+    if lh.IsLHCompressed(data):
+        with Span('lh.decompress') as span:
+            try:
+                data = lh.UncompressLH(data)
+
+            except IndexError:
+                return None
+
+            span.count('bytes', len(data))
+
+    else:
+        data = bytes(data)
+
+    if checkContent(data):
+        return data
+
+
+def ReadLevelData(filename):
+    """
+    Reads a level file once and prepares its data with PrepareLevelData
     """
     if not os.path.isfile(filename):
-        return False
+        return None
 
     with open(filename, 'rb') as f:
-        data = f.read()
+        if not os.fstat(f.fileno()).st_size:
+            return None
 
-    if lh.IsLHCompressed(bytes(data)):
-        try:
-            data = lh.UncompressLH(bytearray(data))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return PrepareLevelData(data)
 
-        except IndexError:
-            return False
 
-    if checkContent(data):
-        return True
+def IsNSMBLevel(filename):
+    """
+    Does some basic checks to confirm a file is a NSMBW level
+    """
+    return ReadLevelData(filename) is not None
 
 
 class Metadata:
@@ -87,51 +114,40 @@ class Metadata:
                 self.DataDict['Website'] = self.DataDict['Webpage']
             return
 
-        # Iterate through the data
+        # Iterate through the data. The keys and values
+        # are sliced out of it without copying
+        data = memoryview(data)
+        unpack = struct.Struct('>I').unpack_from
+        DataDict = self.DataDict
         idx = 4
-        while idx < len(data) - 4:
+        end = len(data) - 4
+        while idx < end:
 
-            # Read the next (first) four bytes - the key length
-            rawKeyLen = data[idx:idx + 4]
+            # Read the key length and the key (as a str)
+            keyLen, = unpack(data, idx)
             idx += 4
 
-            keyLen = (rawKeyLen[0] << 24) | (rawKeyLen[1] << 16) | (rawKeyLen[2] << 8) | rawKeyLen[3]
-
-            # Read the next (key length) bytes - the key (as a str)
-            rawKey = data[idx:idx + keyLen]
+            key = str(data[idx:idx + keyLen], 'latin-1')
             idx += keyLen
 
-            key = ''
-            for b in rawKey: key += chr(b)
-
-            # Read the next four bytes - the number of type entries
-            rawTypeEntries = data[idx:idx + 4]
+            # Read the number of type entries
+            typeEntries, = unpack(data, idx)
             idx += 4
 
-            typeEntries = (rawTypeEntries[0] << 24) | (rawTypeEntries[1] << 16) | (rawTypeEntries[2] << 8) | \
-                          rawTypeEntries[3]
+            if key not in DataDict: DataDict[key] = {}
+            types = DataDict[key]
 
             # Iterate through each type entry
             for entry in range(typeEntries):
-                # Read the next four bytes - the type
-                rawType = data[idx:idx + 4]
-                idx += 4
+                # Read the type and the data length
+                type, = unpack(data, idx)
+                dataLen, = unpack(data, idx + 4)
+                idx += 8
 
-                type = (rawType[0] << 24) | (rawType[1] << 16) | (rawType[2] << 8) | rawType[3]
-
-                # Read the next four bytes - the data length
-                rawDataLen = data[idx:idx + 4]
-                idx += 4
-
-                dataLen = (rawDataLen[0] << 24) | (rawDataLen[1] << 16) | (rawDataLen[2] << 8) | rawDataLen[3]
-
-                # Read the next (data length) bytes - the data (as bytes)
-                entryData = data[idx:idx + dataLen]
+                # Read the data (as a memoryview)
+                types[type] = data[idx:idx + dataLen]
                 idx += dataLen
 
-                # Add it to typeData
-                self.setOtherData(key, type, entryData)
-
     def binData(self, key):
         """
         Returns the binary data associated with key
@@ -179,79 +195,161 @@ class Metadata:
 
     def save(self):
         """
-        Returns a bytes object that can later be loaded from
+        Returns a bytearray that can later be loaded from
         """
 
         # Sort self.DataDict
-        dataDictSorted = []
-        for dataKey in self.DataDict: dataDictSorted.append((dataKey, self.DataDict[dataKey]))
-        dataDictSorted.sort(key=lambda entry: entry[0])
+        dataDictSorted = sorted(self.DataDict.items(), key=lambda entry: entry[0])
 
-        data = []
+        # Work out the size first, so everything can be written into one buffer
+        size = 4
+        for dataKey, types in dataDictSorted:
+            size += 8 + len(dataKey)
+            for typeData in types.values():
+                size += 8 + len(typeData)
+
+        data = bytearray(size)
+        pack = struct.Struct('>I').pack_into
+        packEntry = struct.Struct('>II').pack_into
 
         # Add 'MD2_'
-        data.append(ord('M'))
-        data.append(ord('D'))
-        data.append(ord('2'))
-        data.append(ord('_'))
+        data[0:4] = b'MD2_'
+        idx = 4
 
         # Iterate through self.DataDict
         for dataKey, types in dataDictSorted:
 
-            # Add the key length (4 bytes)
+            # Add the key length (4 bytes) and the key (key length bytes)
             keyLen = len(dataKey)
-            data.append(keyLen >> 24)
-            data.append((keyLen >> 16) & 0xFF)
-            data.append((keyLen >> 8) & 0xFF)
-            data.append(keyLen & 0xFF)
+            pack(data, idx, keyLen)
+            idx += 4
 
-            # Add the key (key length bytes)
-            for char in dataKey: data.append(ord(char))
+            data[idx:idx + keyLen] = dataKey.encode('latin-1')
+            idx += keyLen
 
             # Sort the types
-            typesSorted = []
-            for type in types: typesSorted.append((type, types[type]))
-            typesSorted.sort(key=lambda entry: entry[0])
+            typesSorted = sorted(types.items(), key=lambda entry: entry[0])
 
             # Add the number of types (4 bytes)
-            typeNum = len(typesSorted)
-            data.append(typeNum >> 24)
-            data.append((typeNum >> 16) & 0xFF)
-            data.append((typeNum >> 8) & 0xFF)
-            data.append(typeNum & 0xFF)
+            pack(data, idx, len(typesSorted))
+            idx += 4
 
             # Iterate through typesSorted
             for type, typeData in typesSorted:
 
-                # Add the type (4 bytes)
-                data.append(type >> 24)
-                data.append((type >> 16) & 0xFF)
-                data.append((type >> 8) & 0xFF)
-                data.append(type & 0xFF)
-
-                # Add the data length (4 bytes)
+                # Add the type and the data length (4 bytes each)
                 dataLen = len(typeData)
-                data.append(dataLen >> 24)
-                data.append((dataLen >> 16) & 0xFF)
-                data.append((dataLen >> 8) & 0xFF)
-                data.append(dataLen & 0xFF)
+                packEntry(data, idx, type, dataLen)
+                idx += 8
 
                 # Add the data (data length bytes)
-                for d in typeData: data.append(d)
+                data[idx:idx + dataLen] = typeData
+                idx += dataLen
 
         return data
 
+class ZoneBlocks:
+    """
+    Blocks 3, 5 and 6 of an area: the boundings and the top and bottom
+    level backgrounds. They are decoded when first needed and indexed by ID.
+    Zones look their bounding and backgrounds up here instead of in their
+    area, so they don't keep the area and its files alive.
+    """
+    bdngStruct = struct.Struct('>llllHHxxxx')
+    bgStruct = struct.Struct('>xBhhhhHHHxxxBxxxx')
+
+    def __init__(self, bdngdata=b'', bgAdata=b'', bgBdata=b''):
+        # Copies, as the blocks can be views of the whole level file
+        self.bdngdata = bytes(bdngdata)
+        self.bgAdata = bytes(bgAdata)
+        self.bgBdata = bytes(bgBdata)
+
+        self._bounding = None
+        self._bgA = None
+        self._bgB = None
+        self._boundingIndex = None
+        self._bgAIndex = None
+        self._bgBIndex = None
+
+    @staticmethod
+    def DecodeBlock(data, blockstruct):
+        """
+        Returns the entries of a block as lists, ignoring a trailing partial entry
+        """
+        return [list(entry) for entry in blockstruct.iter_unpack(data[:len(data) - len(data) % blockstruct.size])]
+
+    @property
+    def bounding(self):
+        if self._bounding is None:
+            self._bounding = self.DecodeBlock(self.bdngdata, self.bdngStruct)
+        return self._bounding
+
+    @bounding.setter
+    def bounding(self, value):
+        self._bounding = value
+        self._boundingIndex = None
+
+    @property
+    def bgA(self):
+        if self._bgA is None:
+            self._bgA = self.DecodeBlock(self.bgAdata, self.bgStruct)
+        return self._bgA
+
+    @bgA.setter
+    def bgA(self, value):
+        self._bgA = value
+        self._bgAIndex = None
+
+    @property
+    def bgB(self):
+        if self._bgB is None:
+            self._bgB = self.DecodeBlock(self.bgBdata, self.bgStruct)
+        return self._bgB
+
+    @bgB.setter
+    def bgB(self, value):
+        self._bgB = value
+        self._bgBIndex = None
+
+    def BoundingByID(self, id):
+        """
+        Returns the bounding with the given ID, or None.
+        If several have it, the last one wins.
+        """
+        if self._boundingIndex is None:
+            self._boundingIndex = {bounding[4]: bounding for bounding in self.bounding}
+        return self._boundingIndex.get(id)
+
+    def BackgroundAByID(self, id):
+        """
+        Returns the top level background with the given ID, or None
+        """
+        if self._bgAIndex is None:
+            self._bgAIndex = {bg[0]: bg for bg in self.bgA}
+        return self._bgAIndex.get(id)
+
+    def BackgroundBByID(self, id):
+        """
+        Returns the bottom level background with the given ID, or None
+        """
+        if self._bgBIndex is None:
+            self._bgBIndex = {bg[0]: bg for bg in self.bgB}
+        return self._bgBIndex.get(id)
+
+
 class Game:
     class Level:
         """
         Class for a level from New Super Mario Bros. Wii
         """
 
-        def __init__(self):
+        def __init__(self, columnar=False):
             """
-            Initializes the level with default settings
+            Initializes the level with default settings.
+            If columnar is True, the object layers are loaded as objlayer.ObjectLayers.
             """
             self.areas = []
+            self.columnar = columnar
 
         class Area:
             """
@@ -292,15 +390,16 @@ class Game:
 
                 self.entrances = []
                 self.sprites = []
-                self.bounding = []
-                self.bgA = []
-                self.bgB = []
+                self.zoneBlocks = ZoneBlocks()
                 self.zones = []
                 self.locations = []
                 self.pathdata = []
                 self.paths = []
                 self.comments = []
 
+                # Load the object layers as objlayer.ObjectLayers
+                self.columnar = False
+
             def load(self, course, L0, L1, L2):
                 """
                 Loads an area from the archive files
@@ -314,7 +413,7 @@ class Game:
                 self.LoadOptions()  # block 2
                 self.LoadEntrances()  # block 7
                 self.LoadSprites()  # block 8
-                self.LoadZones()  # block 10 (also blocks 3, 5, and 6)
+                self.LoadZones()  # block 10 (blocks 3, 5, and 6 when needed)
                 self.LoadLocations()  # block 11
                 self.LoadPaths()  # block 12 and 13
 
@@ -419,50 +518,12 @@ class Game:
 
             def LoadZones(self):
                 """
-                Loads block 3, the bounding preferences
-                """
-                bdngdata = self.blocks[2]
-                count = len(bdngdata) // 24
-                bdngstruct = struct.Struct('>llllHHxxxx')
-                offset = 0
-                bounding = []
-                for i in range(count):
-                    datab = bdngstruct.unpack_from(bdngdata, offset)
-                    bounding.append([datab[0], datab[1], datab[2], datab[3], datab[4], datab[5]])
-                    offset += 24
-                self.bounding = bounding
-
-                """
-                Loads block 5, the top level background values
-                """
-                bgAdata = self.blocks[4]
-                bgAcount = len(bgAdata) // 24
-                bgAstruct = struct.Struct('>xBhhhhHHHxxxBxxxx')
-                offset = 0
-                bgA = []
-                for i in range(bgAcount):
-                    data = bgAstruct.unpack_from(bgAdata, offset)
-                    bgA.append([data[0], data[1], data[2], data[3], data[4], data[5], data[6], data[7], data[8]])
-                    offset += 24
-                self.bgA = bgA
-
+                Loads block 10, the zone data.
+                Blocks 3, 5 and 6 are only decoded once something needs them.
                 """
-                Loads block 6, the bottom level background values
-                """
-                bgBdata = self.blocks[5]
-                bgBcount = len(bgBdata) // 24
-                bgBstruct = struct.Struct('>xBhhhhHHHxxxBxxxx')
-                offset = 0
-                bgB = []
-                for i in range(bgBcount):
-                    datab = bgBstruct.unpack_from(bgBdata, offset)
-                    bgB.append([datab[0], datab[1], datab[2], datab[3], datab[4], datab[5], datab[6], datab[7], datab[8]])
-                    offset += 24
-                self.bgB = bgB
+                self.zoneBlocks = ZoneBlocks(self.blocks[2], self.blocks[4], self.blocks[5])
+                zoneBlocks = self.zoneBlocks
 
-                """
-                Loads block 10, the zone data
-                """
                 zonedata = self.blocks[9]
                 zonestruct = struct.Struct('>HHHHHHBBBBxBBBBxBB')
                 count = len(zonedata) // 24
@@ -471,19 +532,48 @@ class Game:
                 for i in range(count):
                     dataz = zonestruct.unpack_from(zonedata, offset)
 
-                    # Find the proper bounding
-                    boundObj = None
-                    id = dataz[7]
-                    for checkb in self.bounding:
-                        if checkb[4] == id: boundObj = checkb
-
+                    # The bounding and backgrounds are looked up by ID when first accessed
                     zones.append(
                         ZoneItem(dataz[0], dataz[1], dataz[2], dataz[3], dataz[4], dataz[5], dataz[6], dataz[7], dataz[8],
-                                 dataz[9], dataz[10], dataz[11], dataz[12], dataz[13], dataz[14], dataz[15], boundObj, bgA, bgB,
-                                 i))
+                                 dataz[9], dataz[10], dataz[11], dataz[12], dataz[13], dataz[14], dataz[15],
+                                 partial(zoneBlocks.BoundingByID, dataz[7]), partial(zoneBlocks.BackgroundAByID, dataz[11]),
+                                 partial(zoneBlocks.BackgroundBByID, dataz[12]), i))
                     offset += 24
                 self.zones = zones
 
+            @property
+            def bounding(self):
+                return self.zoneBlocks.bounding
+
+            @bounding.setter
+            def bounding(self, value):
+                self.zoneBlocks.bounding = value
+
+            @property
+            def bgA(self):
+                return self.zoneBlocks.bgA
+
+            @bgA.setter
+            def bgA(self, value):
+                self.zoneBlocks.bgA = value
+
+            @property
+            def bgB(self):
+                return self.zoneBlocks.bgB
+
+            @bgB.setter
+            def bgB(self, value):
+                self.zoneBlocks.bgB = value
+
+            def BoundingByID(self, id):
+                return self.zoneBlocks.BoundingByID(id)
+
+            def BackgroundAByID(self, id):
+                return self.zoneBlocks.BackgroundAByID(id)
+
+            def BackgroundBByID(self, id):
+                return self.zoneBlocks.BackgroundBByID(id)
+
             def LoadLocations(self):
                 """
                 Loads block 11, the locations
@@ -503,6 +593,10 @@ class Game:
                 """
                 Loads a specific object layer from a string
                 """
+                if self.columnar:
+                    self.layers[idx] = objlayer.ObjectLayer.loadNSMBW(idx, layerdata)
+                    return
+
                 objcount = len(layerdata) // 10
                 objstruct = struct.Struct('>HHHHH')
                 offset = 0
@@ -587,7 +681,11 @@ class Game:
             """
             Loads a NSMBW level from bytes data.
             """
-            arc = archive.U8.load(data)
+            # The files are kept as views of data, not copies
+            with Span('u8.parse') as span:
+                arc = archive.U8.load(data, lazy=True)
+                span.count('files', len(arc.files))
+                span.count('bytes', len(data))
 
             try:
                 arc['course']
@@ -659,7 +757,13 @@ class Game:
 
                 newarea = self.Area()
                 newarea.areanum = thisArea
-                newarea.load(course, L0, L1, L2)
+                newarea.columnar = self.columnar
+                with Span('area.load') as span:
+                    newarea.load(course, L0, L1, L2)
+
+                    if span:
+                        span.count('objects', sum(len(layer) for layer in newarea.layers))
+                        span.count('sprites', len(newarea.sprites))
 
                 self.areas.append(newarea)
 
@@ -671,27 +775,30 @@ class Game:
         """
         Load a level from any game into the editor
         """
-        if not os.path.isfile(name):
+        # Read, decompress and check the file in one go
+        levelData = ReadLevelData(name)
+        if levelData is None:
             return False
 
-        if not IsNSMBLevel(name):
-            return False
-
-         # Open the file
-        with open(name, 'rb') as fileobj:
-            levelData = fileobj.read()
+        return self.LoadLevelData(levelData)
 
-        # Decompress, if needed
-        if lh.IsLHCompressed(bytes(levelData)):
-            try:
-                levelData = lh.UncompressLH(bytearray(levelData))
+    def LoadLevelBytes(self, data):
+        """
+        Load a level from the (possibly compressed) contents of a level file
+        """
+        levelData = PrepareLevelData(data)
+        if levelData is None:
+            return False
 
-            except IndexError:
-                return False
+        return self.LoadLevelData(levelData)
 
+    def LoadLevelData(self, levelData):
+        """
+        Load a level from decompressed data that passed checkContent
+        """
         # Load the actual level
         # Create the new level object
-        self.level = self.Level()
+        self.level = self.Level(self.columnar)
 
         # Load it
         if not self.level.load(levelData):
@@ -699,3 +806,13 @@ class Game:
 
         # If we got this far, everything worked! Return True.
         return True
+
+    def __init__(self, columnar=False):
+        """
+        If columnar is True, the object layers of the levels
+        are loaded as objlayer.ObjectLayers (needs NumPy)
+        """
+        if columnar and not objlayer.AVAILABLE:
+            raise ImportError('Columnar layers need NumPy')
+
+        self.columnar = columnar
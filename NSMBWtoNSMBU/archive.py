@@ -1,10 +1,22 @@
 #!/usr/bin/python
 # -*- coding: latin-1 -*-
 
+from concurrent.futures import ThreadPoolExecutor
+import mmap
 import os
 from common import Struct, WiiArchive, align
 
 
+def _readFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _writeFile(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
 class U8(WiiArchive):
     """
     Class for a U8 (.arc) archive
@@ -41,157 +53,228 @@ class U8(WiiArchive):
         """
         super().__init__()
         self.files = []
+        self._index = {}  # path -> position in self.files
+        self._descendants = {}  # directory path -> paths under it, relative to it
+
+    def _addFile(self, path, value):
+        """
+        Appends an entry to self.files and indexes it
+        """
+        self._index[path] = len(self.files)
+        self.files.append((path, value))
+
+        if value is None:
+            self._descendants.setdefault(path, [])
+
+        pos = path.find('/')
+        while pos != -1:
+            self._descendants.setdefault(path[:pos], []).append(path[pos + 1:])
+            pos = path.find('/', pos + 1)
+
+    def _removeDescendants(self, path):
+        """
+        Removes the entries under the directory path, then indexes the rest again
+        """
+        prefix = path + '/'
+        files = [(item, value) for item, value in self.files if not item.startswith(prefix)]
+
+        self.files = []
+        self._index = {}
+        self._descendants = {}
+        for item, value in files:
+            self._addFile(item, value)
 
     def _dump(self):
         """
         Returns all data in this U8 archive as bytes
         """
-        header = self.U8Header()
-        rootnode = self.U8Node()
+        headerCodec = self.U8Header.compile()
+        nodeStruct = self.U8Node.compile().struct
 
         # constants
-        header.tag = b'U\xAA8-'
-        header.rootnode_offset = 0x20
-        header.zeroes = b'\x00' * 16
-        rootnode.type = 0x0100
+        header = headerCodec.new(tag=b'U\xAA8-', rootnode_offset=0x20, zeroes=b'\x00' * 16)
 
+        # First pass: lay out the nodes, names and file data
         nodes = []
-        strings = b'\x00'
-        data = b''
-
-        for item, value in self.files:
-            node = self.U8Node()
+        names = []
+        stringsSize = 1
+        dataSize = 0
 
-            recursion = item.count('/')
-            if recursion < 0:
-                recursion = 0
-            name = item.split('/')[-1]
-
-            node.name_offset = len(strings)
-            strings += name.encode('latin-1') + b'\x00'
+        for i, (item, value) in enumerate(self.files):
+            name = item.split('/')[-1].encode('latin-1')
+            names.append(name)
 
             if value is None:  # directory
-                node.type = 0x0100
-                node.data_offset = recursion
-
-                node.size = len(nodes) + 1
-                for one, two in self.files:
-                    if one[:len(item)] == item:  # find nodes in the folder
-                        node.size += 1
+                # The size of a directory is the index of the first node after it
+                nodes.append((0x0100, stringsSize, item.count('/'), i + 2 + len(self._descendants[item])))
             else:  # file
-                node.type = 0x0000
-                node.data_offset = len(data)
-                data += value + (b'\x00' * (
-                    align(len(value), 32) - len(
-                        value)))  # 32 seems to work best for fuzzyness? I'm still really not sure
-                node.size = len(value)
-            nodes.append(node)
-
-        header.header_size = ((len(nodes) + 1) * len(rootnode)) + len(strings)
+                nodes.append((0x0000, stringsSize, dataSize, len(value)))
+                dataSize += align(len(value), 32)  # 32 seems to work best for fuzzyness? I'm still really not sure
+
+            stringsSize += len(name) + 1
+
+        header.header_size = ((len(nodes) + 1) * nodeStruct.size) + stringsSize
         header.data_offset = align(header.header_size + header.rootnode_offset, 64)
-        rootnode.size = len(nodes) + 1
-
-        for i in range(len(nodes)):
-            if nodes[i].type == 0x0000:
-                nodes[i].data_offset += header.data_offset
-
-        fd = b''
-        fd += header.pack()
-        fd += rootnode.pack()
-        for node in nodes:
-            fd += node.pack()
-        fd += strings
-        fd += b'\x00' * (header.data_offset - header.rootnode_offset - header.header_size)
-        fd += data
-
-        return fd
-
-    def _dumpDir(self, dir):
-        if not os.path.isdir(dir):
-            os.mkdir(dir)
-        old = os.getcwd()
-        os.chdir(dir)
+
+        # Second pass: write everything into a single buffer
+        fd = bytearray(header.data_offset + dataSize)
+        headerCodec.pack_into(fd, 0, header)
+
+        offset = header.rootnode_offset
+        nodeStruct.pack_into(fd, offset, 0x0100, 0, 0, len(nodes) + 1)
+        offset += nodeStruct.size
+
+        stringsOffset = offset + len(nodes) * nodeStruct.size
+        for (type, name_offset, data_offset, size), name, (item, value) in zip(nodes, names, self.files):
+            if type == 0x0000:
+                data_offset += header.data_offset
+                fd[data_offset:data_offset + size] = value
+
+            nodeStruct.pack_into(fd, offset, type, name_offset, data_offset, size)
+            offset += nodeStruct.size
+
+            name_offset += stringsOffset
+            fd[name_offset:name_offset + len(name)] = name
+
+        return bytes(fd)
+
+    def _dumpDir(self, dir, workers=None):
+        """
+        Extracts the archive to dir.
+        If workers is given, the files are written by that many threads.
+        """
+        root = os.path.abspath(dir)
+        if not os.path.isdir(root):
+            os.mkdir(root)
+
+        # Make all the folders first, then the files can be written in any order
+        files = []
         for item, data in self.files:
+            path = os.path.join(root, *item.split('/'))
             if data is None:
-                if not os.path.isdir(item):
-                    os.mkdir(item)
+                os.makedirs(path, exist_ok=True)
             else:
-                open(item, 'wb').write(data)
-        os.chdir(old)
-
-    def _loadDir(self, dir):
-        try:
-            self._tmpPath += ''
-        except:
-            self._tmpPath = ''
-        old = os.getcwd()
-        os.chdir(dir)
-        entries = os.listdir('.')
-        for entry in entries:
-            if os.path.isdir(entry):
-                self.files.append((self._tmpPath + entry, None))
-                self._tmpPath += entry + '/'
-                self._loadDir(entry)
-            elif os.path.isfile(entry):
-                data = open(entry, 'rb').read()
-                self.files.append((self._tmpPath + entry, data))
-        os.chdir(old)
-        self._tmpPath = self._tmpPath[:self._tmpPath.find('/') + 1]
-
-    def _load(self, data):
-        offset = 0
+                files.append((path, data))
+
+        if workers:
+            with ThreadPoolExecutor(workers) as pool:
+                # Go through the results so errors get raised here
+                for _ in pool.map(_writeFile, [path for path, data in files], [data for path, data in files]):
+                    pass
+        else:
+            for path, data in files:
+                _writeFile(path, data)
+
+    def _loadDir(self, dir, workers=None):
+        """
+        Loads the archive from the files in dir.
+        If workers is given, the files are read by that many threads.
+        """
+        # Walk the tree first, so the files can be read in any order
+        entries = []  # (path in the archive, path on disk or None for folders)
+        stack = [(os.path.abspath(dir), '')]
+        while stack:
+            path, prefix = stack.pop()
+            folders = []
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        folders.append(entry)
+                    elif entry.is_file():
+                        entries.append((prefix + entry.name, entry.path))
+
+            for entry in folders:
+                entries.append((prefix + entry.name, None))
+                stack.append((entry.path, prefix + entry.name + '/'))
+
+        # Sort so every folder is directly followed by its contents
+        entries.sort(key=lambda entry: entry[0].split('/'))
+
+        paths = [path for item, path in entries if path is not None]
+        if workers:
+            with ThreadPoolExecutor(workers) as pool:
+                data = pool.map(_readFile, paths)
+        else:
+            data = map(_readFile, paths)
+
+        for item, path in entries:
+            self._addFile(item, None if path is None else next(data))
+
+    @classmethod
+    def loadFile(cls, filename, lazy=False):
+        """
+        Loads a U8 archive from a file.
+        If lazy is True, the file is mapped into memory instead of being read,
+        so only the parts that get accessed are ever read from disk.
+        """
+        if not lazy:
+            return super().loadFile(filename)
+
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls.load(data, lazy=True)
+
+    def _load(self, data, lazy=False):
+        """
+        Loads the archive from data.
+        If lazy is True, the file bodies are memoryviews of data
+        instead of copies, so nothing but the node table gets read up front.
+        """
         if isinstance(data, str):
             raise TypeError('This isn\'t Python 2 anymore. Only bytes, please.')
 
-        for i in range(len(data)):
-            header = self.U8Header()
-            header.unpack(data[offset:offset + len(header)])
-            if header.tag == b'U\xAA8-':
-                break
-            data = data[1:]
-        offset += len(header)
+        if data[:4] == b'U\xAA8-':
+            base = 0
+
+        elif isinstance(data, memoryview):
+            base = bytes(data).find(b'U\xAA8-')
+
+        else:
+            base = data.find(b'U\xAA8-')
+
+        if base == -1:
+            raise ValueError('Not a U8 archive')
+
+        if lazy:
+            data = memoryview(data)[base:]
+
+        elif base:
+            data = data[base:]
+
+        header = self.U8Header.compile().unpack_from(data)
         offset = header.rootnode_offset
 
-        rootnode = self.U8Node()
-        rootnode.unpack(data[offset:offset + len(rootnode)])
-        offset += len(rootnode)
+        nodeStruct = self.U8Node.compile().struct
+        count = nodeStruct.unpack_from(data, offset)[3]
+        offset += nodeStruct.size
 
-        nodes = []
-        for i in range(rootnode.size - 1):
-            node = self.U8Node()
-            node.unpack(data[offset:offset + len(node)])
-            offset += len(node)
-            nodes.append(node)
-
-        strings = data[offset:offset + header.data_offset - len(header) - (len(rootnode) * rootnode.size)]
-        offset += len(strings)
-
-        recursion = [rootnode.size, ]
-        recursiondir = []
-        counter = 0
-        for node in nodes:
-            counter += 1
-            name = strings[node.name_offset:].split(b'\0', 1)[0].decode('latin-1')
-
-            if node.type == 0x0100:  # folder
-                recursion.append(node.size)
-                recursiondir.append(name)
-                self.files.append(('/'.join(recursiondir), None))
-
-            elif node.type == 0:  # file
-                self.files.append(
-                    ('/'.join(recursiondir) + '/' + name, data[node.data_offset:node.data_offset + node.size]))
-                offset += node.size
+        nodes = nodeStruct.iter_unpack(data[offset:offset + (count - 1) * nodeStruct.size])
+        offset += (count - 1) * nodeStruct.size
+
+        strings = bytes(data[offset:header.data_offset])
+
+        # The size of a directory is the index of the first node after it
+        dirs = []  # (end of the directory, path of the directory + '/')
+        prefix = ''
+        for i, (type, name_offset, data_offset, size) in enumerate(nodes, 1):
+            while dirs and dirs[-1][0] <= i:
+                dirs.pop()
+                prefix = dirs[-1][1] if dirs else ''
+
+            name = strings[name_offset:strings.find(b'\0', name_offset)].decode('latin-1')
+
+            if type == 0x0100:  # folder
+                self._addFile(prefix + name, None)
+                prefix += name + '/'
+                dirs.append((size, prefix))
+
+            elif type == 0:  # file
+                self._addFile(prefix + name, data[data_offset:data_offset + size])
 
             else:  # unknown type -- wtf?
                 pass
 
-            sz = recursion.pop()
-            if sz != counter + 1:
-                recursion.append(sz)
-            else:
-                recursiondir.pop()
-
     def __str__(self):
         """
         Returns a representation of this U8 archive as a string
@@ -212,24 +295,27 @@ class U8(WiiArchive):
         """
         Returns the file requested when one indexes the archive
         """
-        for item, val in self.files:
-            if item == key:
-                if val is not None:
-                    return val
-                else:
-                    ret = []
-                    for item2, val2 in self.files:
-                        if item2.find(item) == 0:
-                            ret.append(item2[len(item) + 1:])
-                    return ret[1:]
-        raise KeyError
+        item, val = self.files[self._index[key]]
+        if val is not None:
+            return val
+
+        return list(self._descendants[item])
 
     def __setitem__(self, key, val):
         """
         Handles the request to set a value to an index of the archive
         """
-        for i in range(len(self.files)):
-            if self.files[i][0] == key:
-                self.files[i] = (self.files[i][0], val)
-                return
-        self.files.append((key, val))
+        i = self._index.get(key)
+        if i is None:
+            self._addFile(key, val)
+            return
+
+        wasDir = self.files[i][1] is None
+        self.files[i] = (key, val)
+
+        if val is None:
+            self._descendants.setdefault(key, [])
+
+        elif wasDir:
+            # A file can't have anything under it
+            self._removeDescendants(key)
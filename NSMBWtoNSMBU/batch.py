@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Converts many NSMBW levels to NSMBU at once, on a pool of processes
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import glob
+import instrument
+import os
+import sys
+import time
+
+
+def FindLevels(inputs):
+    """
+    Returns the level files in inputs, a list of folders, files and glob patterns
+    """
+    levels = []
+    for item in inputs:
+        if os.path.isdir(item):
+            with os.scandir(item) as it:
+                paths = sorted(entry.path for entry in it if entry.is_file() and entry.name.lower().endswith('.arc'))
+
+        else:
+            paths = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+
+        for path in paths:
+            if path not in levels:
+                levels.append(path)
+
+    return levels
+
+
+def OutputPath(outDir, inPath, ext='.sarc'):
+    """
+    Returns where the converted inPath goes in outDir
+    """
+    return os.path.join(outDir, os.path.splitext(os.path.basename(inPath))[0] + ext)
+
+
+def IsUpToDate(inPath, outPath):
+    """
+    Returns True if outPath exists and is newer than inPath
+    """
+    try:
+        return os.stat(outPath).st_mtime > os.stat(inPath).st_mtime
+
+    except FileNotFoundError:
+        return False
+
+
+# Caches of this worker process by (folder, maximum size), kept between jobs
+# so the folder is only scanned once and the hits and misses add up
+_levelCaches = {}
+
+
+def ConvertJob(inPath, outPath, cacheDir=None, cacheSize=None, yaz0Level=None, profile=False, trackMemory=False):
+    """
+    Converts one level, in a worker process.
+    Returns the time it took, whether it came from the cache,
+    the durations and counters of its spans if profile is True,
+    the peak memory of its stages if trackMemory is True,
+    the (hits, misses) of the cache during the job, and the error if it failed.
+    """
+    import convert
+
+    if cacheDir is None:
+        levelCache = None
+
+    else:
+        levelCache = _levelCaches.get((cacheDir, cacheSize))
+        if levelCache is None:
+            from cache import ConversionCache
+            levelCache = _levelCaches[cacheDir, cacheSize] = ConversionCache(cacheDir, cacheSize)
+
+        hits, misses = levelCache.hits, levelCache.misses
+
+    memory = {} if trackMemory else None
+
+    sink = instrument.AggregateSink() if profile else None
+    previous = instrument.SetSink(sink)
+    cached = False
+    error = None
+    try:
+        start = time.perf_counter()
+        cached = convert.ConvertFile(inPath, outPath, levelCache, yaz0Level=yaz0Level, memory=memory)
+        seconds = time.perf_counter() - start
+
+    except Exception as e:
+        # Caught here rather than in RunBatch, so the cache counts of failed jobs get back too
+        seconds = 0.0
+        error = '%s: %s' % (type(e).__name__, e)
+
+    finally:
+        instrument.SetSink(previous)
+
+    cacheCounts = None if levelCache is None else (levelCache.hits - hits, levelCache.misses - misses)
+    return seconds, cached, None if sink is None else (sink.durations, sink.counters), memory, cacheCounts, error
+
+
+def RunBatch(inputs, outDir, workers=None, force=False, log=print, cacheDir=None, cacheSize=None, yaz0Level=None,
+             profile=None, memory=None, memoryBudget=None, cacheCounts=None):
+    """
+    Converts the levels in inputs to outDir, using up to workers processes.
+    Levels whose output is newer than them are skipped unless force is True.
+    If cacheDir is given, the outputs are cached there, up to cacheSize bytes,
+    and if cacheCounts is a dict, the 'hits' and 'misses' of the cache are added to it.
+    If yaz0Level is given, the outputs are compressed to .szs files at that level.
+    If profile (an instrument.AggregateSink) is given, the spans of every conversion are added to it.
+    If memory is a dict, the highest peak memory of every stage is put in it.
+    If memoryBudget is given, the levels being converted at the same time are
+    estimated to need at most that many bytes together: the others wait their
+    turn, and levels that need more than that on their own fail.
+    Returns a list of (input path, status, seconds, error) with status being
+    'converted', 'cached', 'skipped' or 'failed'.
+    """
+    os.makedirs(outDir, exist_ok=True)
+
+    results = []
+    jobs = []
+    outPaths = {}
+    for inPath in FindLevels(inputs):
+        outPath = OutputPath(outDir, inPath, '.sarc' if yaz0Level is None else '.szs')
+
+        if outPath in outPaths:
+            error = 'Same output as %s' % outPaths[outPath]
+            log('FAILED     %s: %s' % (inPath, error))
+            results.append((inPath, 'failed', 0.0, error))
+
+        elif not force and IsUpToDate(inPath, outPath):
+            log('skipped    %s' % inPath)
+            results.append((inPath, 'skipped', 0.0, None))
+
+        else:
+            jobs.append((inPath, outPath))
+
+        outPaths.setdefault(outPath, inPath)
+
+    if memoryBudget is None:
+        estimates = [0] * len(jobs)
+
+    else:
+        import convert
+
+        estimates = []
+        for inPath, outPath in jobs:
+            estimates.append(convert.EstimateFileMemory(inPath, yaz0Level))
+            if estimates[-1] > memoryBudget:
+                error = 'Needs about %d MiB, the budget is %d MiB' % (estimates[-1] >> 20, memoryBudget >> 20)
+                log('FAILED     %s: %s' % (inPath, error))
+                results.append((inPath, 'failed', 0.0, error))
+
+        jobs = [job for job, estimate in zip(jobs, estimates) if estimate <= memoryBudget]
+        estimates = [estimate for estimate in estimates if estimate <= memoryBudget]
+
+    if not jobs:
+        return results
+
+    with ProcessPoolExecutor(workers) as pool:
+        running = {}  # future -> (input path, estimated memory)
+        inFlight = 0
+        nextJob = 0
+
+        while nextJob < len(jobs) or running:
+            # Start the levels in order, as long as they fit in the budget
+            while nextJob < len(jobs) and (memoryBudget is None or inFlight + estimates[nextJob] <= memoryBudget):
+                inPath, outPath = jobs[nextJob]
+                future = pool.submit(ConvertJob, inPath, outPath, cacheDir, cacheSize, yaz0Level,
+                                     profile is not None, memory is not None)
+                running[future] = inPath, estimates[nextJob]
+                inFlight += estimates[nextJob]
+                nextJob += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                inPath, estimate = running.pop(future)
+                inFlight -= estimate
+
+                try:
+                    seconds, cached, spans, peaks, jobCacheCounts, error = future.result()
+
+                except Exception as e:
+                    # The job could not run, e.g. its worker process died
+                    seconds, cached, spans, peaks, jobCacheCounts = 0.0, False, None, None, None
+                    error = '%s: %s' % (type(e).__name__, e)
+
+                if jobCacheCounts is not None and cacheCounts is not None:
+                    cacheCounts['hits'] = cacheCounts.get('hits', 0) + jobCacheCounts[0]
+                    cacheCounts['misses'] = cacheCounts.get('misses', 0) + jobCacheCounts[1]
+
+                if error is not None:
+                    log('FAILED     %s: %s' % (inPath, error))
+                    results.append((inPath, 'failed', 0.0, error))
+                    continue
+
+                if spans is not None:
+                    profile.merge(*spans)
+
+                if peaks:
+                    for name, peak in peaks.items():
+                        memory[name] = max(memory.get(name, 0), peak)
+
+                    log('%7.3fs %8.1fMiB   %s' % (seconds, peaks['total'] / 1048576, inPath))
+
+                else:
+                    log('%7.3fs   %s%s' % (seconds, inPath, ' (cached)' if cached else ''))
+
+                results.append((inPath, 'cached' if cached else 'converted', seconds, None))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Converts NSMBW levels to NSMBU levels.')
+    parser.add_argument('inputs', nargs='+', help='level files, folders of .arc files or glob patterns')
+    parser.add_argument('-o', '--output', required=True, help='folder to write the .sarc files to')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: one per CPU)')
+    parser.add_argument('-f', '--force', action='store_true', help='convert levels even if their output is up to date')
+    parser.add_argument('-z', '--szs', type=int, nargs='?', const=6, metavar='LEVEL',
+                        help='compress the outputs to .szs, at LEVEL 0-9 (default: 6)')
+    parser.add_argument('--cache', metavar='DIR', help='folder to cache converted levels in')
+    parser.add_argument('--cache-size', type=int, default=512, metavar='MB', help='maximum size of the cache (default: 512)')
+    parser.add_argument('--profile', action='store_true', help='print histograms of the time spent in every stage')
+    parser.add_argument('--memory', action='store_true', help='measure the peak memory of every stage (slower)')
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help='memory the levels being converted may need together; bigger levels fail')
+    args = parser.parse_args(argv)
+
+    profile = instrument.AggregateSink() if args.profile else None
+    memory = {} if args.memory else None
+    memoryBudget = None if args.memory_budget is None else args.memory_budget * 1024 * 1024
+    cacheCounts = {'hits': 0, 'misses': 0}
+
+    start = time.perf_counter()
+    results = RunBatch(args.inputs, args.output, args.workers, args.force,
+                       cacheDir=args.cache, cacheSize=args.cache_size * 1024 * 1024, yaz0Level=args.szs, profile=profile,
+                       memory=memory, memoryBudget=memoryBudget, cacheCounts=cacheCounts)
+    elapsed = time.perf_counter() - start
+
+    counts = {'converted': 0, 'cached': 0, 'skipped': 0, 'failed': 0}
+    for inPath, status, seconds, error in results:
+        counts[status] += 1
+
+    print('-' * 80)
+    print('%d converted, %d skipped, %d failed in %.3fs'
+          % (counts['converted'] + counts['cached'], counts['skipped'], counts['failed'], elapsed))
+
+    if args.cache is not None:
+        print('cache: %d hits, %d misses' % (cacheCounts['hits'], cacheCounts['misses']))
+
+    if memory:
+        print('peak memory: ' + ', '.join('%s %.1fMiB' % (name, peak / 1048576)
+                                          for name, peak in sorted(memory.items(), key=lambda item: -item[1])))
+
+    if profile is not None:
+        print('-' * 80)
+        print(profile.report())
+
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
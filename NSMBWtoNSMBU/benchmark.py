@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# End to end conversion benchmark on synthetic levels:
+# NSMBW.Game.LoadLevel, then the conversion, then NSMBU.Game.Level.save
+
+import argparse
+import convert
+import corpus
+import NSMBW
+import objlayer
+import os
+import tempfile
+import time
+import tracemalloc
+
+STAGE_NAMES = ('load', 'transform', 'save')
+
+
+def RunStages(path, columnar):
+    """
+    Converts the level file at path, yielding the name and result of every stage
+    """
+    nsmbw = NSMBW.Game(columnar)
+    if not nsmbw.LoadLevel(path):
+        raise ValueError('Could not load %s' % path)
+    yield 'load', nsmbw.level
+
+    nsmbuLevel = convert.ConvertLevel(nsmbw.level)
+    yield 'transform', nsmbuLevel
+
+    yield 'save', nsmbuLevel.save()
+
+
+def CountObjects(path):
+    """
+    Returns the number of objects in all the layers of the level file at path
+    """
+    nsmbw = NSMBW.Game()
+    nsmbw.LoadLevel(path)
+    return sum(len(layer) for area in nsmbw.level.areas for layer in area.layers)
+
+
+def TimeLevel(path, repeat=5, columnar=objlayer.AVAILABLE):
+    """
+    Returns the best time of every stage over repeat conversions of the level at path
+    """
+    best = dict.fromkeys(STAGE_NAMES, float('inf'))
+    for i in range(repeat):
+        start = time.perf_counter()
+        for name, result in RunStages(path, columnar):
+            end = time.perf_counter()
+            best[name] = min(best[name], end - start)
+            start = end
+
+    return best
+
+
+def MeasureMemory(path, columnar=objlayer.AVAILABLE):
+    """
+    Returns the peak memory allocated by every stage, in bytes, for one conversion of the level at path.
+    This is a separate run, as tracing the allocations slows everything down.
+    """
+    peaks = {}
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        for name, result in RunStages(path, columnar):
+            peaks[name] = tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    return peaks
+
+
+def RunBenchmark(tiers=None, repeat=5, seed=0, layers=1, compress=None, columnar=objlayer.AVAILABLE, log=print):
+    """
+    Benchmarks a synthetic level of every tier in tiers (names of corpus.TIERS).
+    Returns a dict of tier name to a dict with the level 'size', 'objects',
+    the best 'times' and 'peaks' of memory of every stage and 'objectsPerSecond'.
+    """
+    if tiers is None:
+        tiers = list(corpus.TIERS)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for tier in tiers:
+            data = corpus.MakeLevel(seed, layers=layers, compress=compress, **corpus.TIERS[tier])
+            path = os.path.join(tmp, tier + '.arc')
+            with open(path, 'wb') as out:
+                out.write(data)
+
+            objects = CountObjects(path)
+            times = TimeLevel(path, repeat, columnar)
+            peaks = MeasureMemory(path, columnar)
+
+            results[tier] = {
+                'size': len(data),
+                'objects': objects,
+                'times': times,
+                'peaks': peaks,
+                'objectsPerSecond': objects / sum(times.values()),
+            }
+
+            log(FormatResult(tier, results[tier]))
+
+    return results
+
+
+def FormatResult(tier, result):
+    """
+    Returns a line of the benchmark table for one tier
+    """
+    line = '%-8s %9d %8d' % (tier, result['size'], result['objects'])
+    for name in STAGE_NAMES:
+        line += ' %9.2fms %8.1fK' % (result['times'][name] * 1000, result['peaks'][name] / 1024)
+
+    return line + ' %11.0f' % result['objectsPerSecond']
+
+
+def FormatHeader():
+    """
+    Returns the header of the benchmark table
+    """
+    line = '%-8s %9s %8s' % ('tier', 'bytes', 'objects')
+    for name in STAGE_NAMES:
+        line += ' %11s %9s' % (name, 'peak')
+
+    return line + ' %11s' % 'objects/s'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the conversion of synthetic levels.')
+    parser.add_argument('tiers', nargs='*', help='size tiers to run: %s (default: all)' % ', '.join(corpus.TIERS))
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='conversions per tier, the best is kept (default: 5)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the levels (default: 0)')
+    parser.add_argument('--layers', type=int, default=1, help='layers per area (default: 1)')
+    parser.add_argument('--lh', type=int, nargs='?', const=6, metavar='LEVEL',
+                        help='LH compress the levels at LEVEL 0-9 (default: 6)')
+    parser.add_argument('--no-columnar', dest='columnar', action='store_false',
+                        help="don't load the object layers as NumPy arrays")
+    args = parser.parse_args(argv)
+
+    for tier in args.tiers:
+        if tier not in corpus.TIERS:
+            parser.error('unknown tier: %s' % tier)
+
+    print(FormatHeader())
+    RunBenchmark(args.tiers or None, args.repeat, args.seed, args.layers, args.lh, args.columnar and objlayer.AVAILABLE)
+
+
+if __name__ == '__main__':
+    main()
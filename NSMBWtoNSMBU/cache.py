@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Content-addressed disk cache of converted levels
+
+import hashlib
+import os
+
+
+class ConversionCache:
+    """
+    Folder of converted levels, named after a hash of the input level and
+    the converter tables. The least recently used ones are deleted when the
+    folder gets bigger than maxSize bytes.
+    Several processes can share the same folder. Each one only counts what it
+    adds since it last scanned the folder, so the folder can go over maxSize
+    by what the others added in the meantime.
+    """
+
+    # Evicting goes down to this part of maxSize, so a full cache isn't scanned on every put
+    LOW_WATER = 0.9
+
+    def __init__(self, path, maxSize=512 * 1024 * 1024):
+        self.path = path
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.size = None  # Size of the entries, None until the folder is scanned
+
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(data, version):
+        """
+        Returns the key for the input level data, converted with the given tables version
+        """
+        h = hashlib.sha256(version.encode('utf-8'))
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the output cached for key, or None
+        """
+        path = os.path.join(self.path, key + '.sarc')
+        try:
+            with open(path, 'rb') as inf:
+                data = inf.read()
+
+            # Mark it as recently used
+            os.utime(path)
+
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Adds the output for key to the cache, then evicts old entries if needed
+        """
+        path = os.path.join(self.path, key + '.sarc')
+
+        # Write to a temporary file first, so other processes never see half a file
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'wb') as out:
+            out.write(data)
+
+        os.replace(temp, path)
+
+        if self.size is not None:
+            self.size += len(data)
+
+        if self.size is None or self.size > self.maxSize:
+            self.evict()
+
+    def evict(self):
+        """
+        Scans the folder and, if it is bigger than maxSize, deletes the least
+        recently used entries until it is down to LOW_WATER of maxSize
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.endswith('.sarc'):
+                    continue
+
+                try:
+                    stat = entry.stat()
+
+                except FileNotFoundError:
+                    continue  # Deleted by another process
+
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        target = self.maxSize if total <= self.maxSize else int(self.maxSize * self.LOW_WATER)
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+
+            try:
+                os.remove(path)
+
+            except FileNotFoundError:
+                pass
+
+            total -= size
+
+        self.size = total
@@ -292,6 +292,150 @@ class Struct(object):
     def __getitem__(self, value):
         return [('struct', self.__class__)] * value
 
+    @classmethod
+    def compile(cls):
+        """
+        Returns the CompiledStruct for this class, compiling it the first time
+        """
+        try:
+            return _compiledStructs[cls]
+        except KeyError:
+            compiled = _compiledStructs[cls] = CompiledStruct(cls)
+            return compiled
+
+
+_compiledStructs = {}
+
+
+class CompiledStruct(object):
+    """
+    Codec for a Struct subclass, compiled once into a precomputed
+    struct.Struct and a record class with __slots__.
+    Only flat Structs (numbers and fixed size strings) can be compiled.
+    """
+
+    def __init__(self, cls):
+        template = cls()
+
+        format = template.__endian__
+        names = []
+        defaults = []
+        self.strings = []  # (index, encoding, stripNulls) of the strings that need decoding
+
+        for sdef, size, attrs in zip(template.__defs__, template.__sizes__, template.__attrs__):
+            if sdef == Struct.string:
+                size, offset, encoding, stripNulls, value = size
+                if isinstance(size, str) or attrs[0] == '*':
+                    raise StructException('Can\'t compile variable size or array string %s' % attrs)
+
+                if stripNulls and encoding is None:
+                    # Struct.unpack fails on these, as it strips str characters from bytes
+                    raise StructException('Can\'t compile string %s, stripping nulls needs an encoding' % attrs)
+
+                if encoding is not None:
+                    self.strings.append((len(names), encoding, stripNulls))
+
+                # Like Struct, offset only counts for variable size strings
+                format += '%ds' % size
+                names.append(attrs)
+                defaults.append('' if encoding is not None else b'')
+
+            elif sdef == Struct:
+                raise StructException('Can\'t compile nested struct %s' % attrs)
+
+            else:
+                for name in attrs:
+                    if name[0] == '*':
+                        raise StructException('Can\'t compile array %s' % name)
+
+                format += sdef
+                names += attrs
+                defaults += [0] * len(attrs)
+
+        self.struct = struct.Struct(format)
+        self.size = self.struct.size
+        self.names = tuple(names)
+        self.defaults = tuple(defaults)
+
+        # Generate the record class, with an __init__ taking every field in order
+        code = 'def __init__(self, %s):\n' % ', '.join(names)
+        code += ''.join('    self.%s = %s\n' % (name, name) for name in names)
+        namespace = {}
+        exec(code or 'def __init__(self):\n    pass\n', namespace)
+
+        self.record = type(cls.__name__ + 'Record', (StructRecord,), {
+            '__slots__': self.names,
+            '__init__': namespace['__init__'],
+        })
+
+    def __len__(self):
+        return self.size
+
+    def new(self, **kwargs):
+        """
+        Returns a new record with default values, updated with kwargs
+        """
+        record = self.record(*self.defaults)
+        for name in kwargs:
+            setattr(record, name, kwargs[name])
+
+        return record
+
+    def _record(self, values):
+        if self.strings:
+            values = list(values)
+            for i, encoding, stripNulls in self.strings:
+                # Decoded, then stripped the same way Struct.unpack does it
+                values[i] = values[i].decode(encoding)
+                if stripNulls:
+                    values[i] = values[i].rstrip(r'\0')
+
+        return self.record(*values)
+
+    def _values(self, record):
+        values = [getattr(record, name) for name in self.names]
+        for i, encoding, stripNulls in self.strings:
+            values[i] = values[i].encode(encoding)
+
+        return values
+
+    def unpack(self, data):
+        return self._record(self.struct.unpack(data))
+
+    def unpack_from(self, data, offset=0):
+        return self._record(self.struct.unpack_from(data, offset))
+
+    def iter_unpack(self, data):
+        """
+        Unpacks an array of records filling data
+        """
+        record = self._record
+        for values in self.struct.iter_unpack(data):
+            yield record(values)
+
+    def pack(self, record):
+        return self.struct.pack(*self._values(record))
+
+    def pack_into(self, buffer, offset, record):
+        self.struct.pack_into(buffer, offset, *self._values(record))
+
+
+class StructRecord(object):
+    """
+    Base class of the records of a CompiledStruct
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__))
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
 
 class WiiObject(object):
     @classmethod
@@ -314,15 +458,15 @@ class WiiObject(object):
 
 class WiiArchive(WiiObject):
     @classmethod
-    def loadDir(cls, dirname):
+    def loadDir(cls, dirname, *args, **kwargs):
         self = cls()
-        self._loadDir(dirname)
+        self._loadDir(dirname, *args, **kwargs)
         return self
 
-    def dumpDir(self, dirname):
+    def dumpDir(self, dirname, *args, **kwargs):
         if not os.path.isdir(dirname):
             os.mkdir(dirname)
-        self._dumpDir(dirname)
+        self._dumpDir(dirname, *args, **kwargs)
         return dirname
 
 
@@ -379,3 +523,108 @@ def hexdump2(src, length=16):  # dumps to a 'hex editor' style output
         printable = s.translate(''.join([(len(repr(chr(x))) == 3) and chr(x) or '.' for x in range(256)]))
         result.append('0x%04X   %-*s   %s\n' % (i, (length * 3) + 2, hexa, printable))
     return ''.join(result)
+
+
+def MatchLength(data, a, b, limit):
+    """
+    Returns how many bytes at a and b are the same, up to limit
+    """
+    length = 0
+    while length + 16 <= limit and data[a + length:a + length + 16] == data[b + length:b + length + 16]:
+        length += 16
+
+    while length < limit and data[a + length] == data[b + length]:
+        length += 1
+
+    return length
+
+
+def LZTokens(data, maxChain, niceLength, lazy, maxMatch, maxDistance):
+    """
+    Splits data (bytes) into LZ tokens: literal bytes (ints) and
+    (length, distance) tuples of matches at least 3 bytes long.
+    Matches are found with hash chains of 3 byte keys, following up to
+    maxChain candidates and stopping early at niceLength. If lazy is True,
+    a match is dropped for a literal when the next byte starts a longer one.
+    maxChain 0 only gives literals.
+    """
+    dataSize = len(data)
+
+    tokens = []  # literal byte, or (length, distance)
+    head = {}
+    prev = [-1] * dataSize if maxChain else None
+
+    def find(pos):
+        limit = min(maxMatch, dataSize - pos)
+        if limit < 3:
+            return 0, 0
+
+        key = data[pos:pos + 3]
+        candidate = head.get(key, -1)
+        prev[pos] = candidate
+        head[key] = pos
+
+        bestLength = 2
+        bestDistance = 0
+        chain = maxChain
+        while candidate >= 0 and pos - candidate <= maxDistance and chain:
+            if data[candidate + bestLength] == data[pos + bestLength]:
+                length = MatchLength(data, candidate, pos, limit)
+                if length > bestLength:
+                    bestLength = length
+                    bestDistance = pos - candidate
+                    if length >= niceLength or length == limit:
+                        break
+
+            candidate = prev[candidate]
+            chain -= 1
+
+        if bestDistance:
+            return bestLength, bestDistance
+
+        return 0, 0
+
+    def insert(pos):
+        if pos + 3 <= dataSize:
+            key = data[pos:pos + 3]
+            prev[pos] = head.get(key, -1)
+            head[key] = pos
+
+    pos = 0
+    if maxChain:
+        length, distance = find(0)
+
+    while pos < dataSize:
+        if not maxChain:
+            tokens.append(data[pos])
+            pos += 1
+            continue
+
+        if length and lazy and length < niceLength and pos + 1 < dataSize:
+            # Take a literal instead if the next byte starts a longer match
+            nextLength, nextDistance = find(pos + 1)
+            if nextLength > length:
+                tokens.append(data[pos])
+                pos += 1
+                length, distance = nextLength, nextDistance
+                continue
+
+            tokens.append((length, distance))
+            for i in range(pos + 2, pos + length):
+                insert(i)
+
+        elif length:
+            tokens.append((length, distance))
+            for i in range(pos + 1, pos + length):
+                insert(i)
+
+        else:
+            tokens.append(data[pos])
+            pos += 1
+            length, distance = find(pos)
+            continue
+
+        pos += length
+        length, distance = find(pos)
+
+    return tokens
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Conversion of NSMBW levels to NSMBU levels
+
+import hashlib
+from instrument import Span
+import NSMBW
+import NSMBU
+import lh
+import objlayer
+import os
+import time
+import tracemalloc
+import yaz0
+
+# Bump this whenever the conversion rules in ConvertLevel change,
+# so cached conversions made by older versions don't get used
+CONVERTER_VERSION = 1
+
+pa0Obj = {
+    0: 0, 1: 1, 2: 2, 3: 3, 4: 156, 5: 157, 6: 158, 7: 159, 8: 160, 9: 161,
+    10: 162, 11: 163, 12: 164, 13: 165, 14: 166, 15: 167, 16: 4,
+    17: 5, 18: 6, 19: 7, 20: 8, 21: 9,
+    22: 10, 23: 11, 24: 12, 25: 13, 26: 15, 27: 16, 28: 17, 29: 18,
+    30: 19, 31: 20, 32: 21, 33: 22, 34: 23, 35: 24, 36: 25, 37: 26,
+    38: 28, 39: 29, 40: 30, 41: 31, 42: 32, 43: 33, 44: 34, 45: 35,
+    46: 36, 47: 37, 48: 38, 49: 40, 50: 41, 51: 42, 52: 43, 53: 44,
+    55: 45, 56: 46, 58: 47, 59: 49, 60: 50, 63: 51, 64: 52, 65: 56,
+    66: 57, 67: 58, 68: 59, 69: 60, 70: 61, 71: 61, 72: 60, 73: 62,
+    74: 63, 75: 64, 76: 65, 77: 66, 78: 67, 79: 68, 80: 69, 81: 70,
+    82: 71, 83: 72, 84: 73, 85: 74, 86: 75, 87: 76, 88: 77, 89: 78,
+    90: 79, 91: 80, 92: 80, 93: 79, 94: 81, 96: 82, 97: 54, 98: 83,
+}
+
+# Pa3 rail objects below RAIL_TYPES are moved to Pa0, at RAIL_OFFSET
+RAIL_TILESETS = ("Pa3_rail", "Pa3_rail_white")
+RAIL_TYPES = 29
+RAIL_OFFSET = 84
+
+# Estimate of the memory a conversion allocates: MEMORY_BASE plus MEMORY_FACTOR
+# bytes per byte of decompressed level, or MEMORY_FACTOR_YAZ0 when compressing
+# the output to Yaz0. Measured on the levels of benchmark.py, without NumPy.
+MEMORY_BASE = 1024 * 1024
+MEMORY_FACTOR = 32
+MEMORY_FACTOR_YAZ0 = 96
+
+# Zone types
+ZONE_TYPE_NORMAL = 0
+ZONE_TYPE_SPECIAL = 1  # Credits, ambush or toad house
+ZONE_TYPE_TOAD_HOUSE_2 = 160
+
+
+def TablesVersion():
+    """
+    Returns a hash of the converter version and tables, for keying cached conversions
+    """
+    tables = repr((CONVERTER_VERSION, sorted(pa0Obj.items()), RAIL_TILESETS, RAIL_TYPES, RAIL_OFFSET,
+                   ZONE_TYPE_NORMAL, ZONE_TYPE_SPECIAL, ZONE_TYPE_TOAD_HOUSE_2))
+
+    return hashlib.sha256(tables.encode('utf-8')).hexdigest()
+
+
+def ConvertLevel(nsmbwLevel):
+    """
+    Converts a NSMBW.Game.Level to a NSMBU.Game.Level
+    """
+    nsmbuLevel = NSMBU.Game.Level()
+
+    for nsmbwArea in nsmbwLevel.areas:
+        nsmbuLevel.areas.append(nsmbuLevel.Area())
+        nsmbuArea = nsmbuLevel.areas[-1]
+        nsmbuArea.areanum = nsmbwArea.areanum
+        nsmbuArea.tileset0 = nsmbwArea.tileset0
+        nsmbuArea.tileset1 = nsmbwArea.tileset1
+        nsmbuArea.tileset2 = nsmbwArea.tileset2
+        nsmbuArea.tileset3 = nsmbwArea.tileset3
+        nsmbuArea.startEntrance = nsmbwArea.startEntrance
+        nsmbuArea.wrapedges = 1 if nsmbwArea.wrapFlag else 0
+        nsmbuArea.timelimit = nsmbwArea.timeLimit + 100
+        nsmbuArea.Metadata = nsmbwArea.Metadata
+
+        with Span('remap.zones') as span:
+            nsmbuArea.zones = nsmbwArea.zones.copy()
+            span.count('zones', len(nsmbuArea.zones))
+            RemapZones(nsmbwArea, nsmbuArea)
+
+        with Span('remap.objects') as span:
+            nsmbuArea.layers = nsmbwArea.layers.copy()
+            for layer in nsmbuArea.layers:
+                RemapLayer(nsmbuArea, layer)
+
+            if span:
+                span.count('objects', sum(len(layer) for layer in nsmbuArea.layers))
+
+        nsmbuArea.locations = nsmbwArea.locations.copy()
+        nsmbuArea.entrances = nsmbwArea.entrances.copy()
+        for entrance in nsmbuArea.entrances:
+            entrance.unk05 = entrance.unk0C = entrance.unk0F = entrance.unk12 = entrance.camera = entrance.pathID = entrance.pathnodeindex = entrance.unk16 = 0
+
+    return nsmbuLevel
+
+
+def RemapZones(nsmbwArea, nsmbuArea):
+    """
+    Sets the background and type of the zones of nsmbuArea
+    """
+    if nsmbwArea.creditsFlag or nsmbwArea.ambushFlag or (nsmbwArea.toadHouseType and nsmbwArea.toadHouseType != 2):
+        type = ZONE_TYPE_SPECIAL
+
+    elif nsmbwArea.toadHouseType == 2:
+        type = ZONE_TYPE_TOAD_HOUSE_2
+
+    else:
+        type = ZONE_TYPE_NORMAL
+
+    for zone in nsmbuArea.zones:
+        zone.background = nsmbuArea.bgs[0]
+        zone.type = type
+
+
+def RemapLayer(nsmbuArea, layer):
+    """
+    Converts the object types of a layer of nsmbuArea to NSMBU
+    """
+    if isinstance(layer, objlayer.ObjectLayer):
+        layer.remapTypes(0, pa0Obj)
+        if nsmbuArea.tileset3 in RAIL_TILESETS:
+            layer.moveTypes(3, 0, RAIL_TYPES, RAIL_OFFSET)
+
+        layer.setData(0)
+        return
+
+    for obj in layer:
+        if obj.tileset == 0:
+            if obj.type in pa0Obj:
+                obj.type = pa0Obj[obj.type]
+
+            else:
+                obj.type = 0
+
+        if obj.tileset == 3 and nsmbuArea.tileset3 in RAIL_TILESETS and obj.type < RAIL_TYPES:
+            obj.type += RAIL_OFFSET
+            obj.tileset = 0
+
+        obj.data = 0
+
+
+class ConversionCancelled(Exception):
+    """
+    Raised by ConvertBytes when it gets cancelled between two stages
+    """
+    pass
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    Raised by ConvertBytes for levels that would need more memory than the budget
+    """
+    pass
+
+
+def EstimateMemory(data, size=None, yaz0Level=None):
+    """
+    Returns an estimate of the memory converting a level file would allocate, in bytes.
+    data only needs to be the first 8 bytes of the file if size, the size of the file, is given.
+    """
+    if size is None:
+        size = len(data)
+
+    if lh.IsLHCompressed(data):
+        size = lh.GetUncompressedSize(data)
+
+    return MEMORY_BASE + size * (MEMORY_FACTOR if yaz0Level is None else MEMORY_FACTOR_YAZ0)
+
+
+def EstimateFileMemory(path, yaz0Level=None):
+    """
+    Returns EstimateMemory for the level file at path, reading only its header
+    """
+    with open(path, 'rb') as inf:
+        return EstimateMemory(inf.read(8), os.fstat(inf.fileno()).st_size, yaz0Level)
+
+
+def Decompress(data):
+    """
+    Stage 1: decompresses the contents of a NSMBW level file if needed
+    """
+    levelData = NSMBW.PrepareLevelData(data)
+    if levelData is None:
+        raise ValueError('Not a NSMBW level')
+
+    return levelData
+
+
+def Parse(levelData, columnar=objlayer.AVAILABLE):
+    """
+    Stage 2: parses decompressed level data into a NSMBW.Game.Level.
+    The columnar object layers are used if NumPy is there.
+    """
+    nsmbw = NSMBW.Game(columnar)
+    nsmbw.LoadLevelData(levelData)
+    return nsmbw.level
+
+
+def Serialize(nsmbuLevel):
+    """
+    Stage 4: returns the contents of the NSMBU level file for nsmbuLevel
+    """
+    return nsmbuLevel.save()
+
+
+# Stage 3 is ConvertLevel
+STAGES = (
+    ('decompress', Decompress),
+    ('parse', Parse),
+    ('transform', ConvertLevel),
+    ('serialize', Serialize),
+)
+
+
+def ConvertBytes(data, timings=None, cancel=None, yaz0Level=None, memory=None, memoryBudget=None):
+    """
+    Converts the contents of a NSMBW level file to the contents of a NSMBU one.
+    If timings is a dict, the time taken by every stage is added to it.
+    If cancel is given (e.g. a threading.Event), ConversionCancelled is
+    raised before the next stage once cancel.is_set() returns True.
+    If yaz0Level is given, a last stage compresses the output to Yaz0 at that level.
+    If memory is a dict, the peak memory allocated by every stage is put in it,
+    with 'total' for the whole conversion. This uses tracemalloc, which slows things down.
+    If memoryBudget is given, MemoryBudgetExceeded is raised before converting
+    levels that EstimateMemory says need more bytes than that.
+    """
+    if memoryBudget is not None:
+        estimate = EstimateMemory(data, yaz0Level=yaz0Level)
+        if estimate > memoryBudget:
+            raise MemoryBudgetExceeded('Needs about %d MiB, the budget is %d MiB'
+                                       % (estimate >> 20, memoryBudget >> 20))
+
+    stages = STAGES
+    if yaz0Level is not None:
+        stages += (('compress', lambda data: yaz0.CompressYaz0(data, yaz0Level)),)
+
+    tracing = memory is not None and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+
+    try:
+        if memory is not None:
+            first = tracemalloc.get_traced_memory()[0]
+
+        value = data
+        for name, stage in stages:
+            if cancel is not None and cancel.is_set():
+                raise ConversionCancelled('Cancelled before %s' % name)
+
+            if memory is not None:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+
+            start = time.perf_counter()
+            with Span(name):
+                value = stage(value)
+
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+            if memory is not None:
+                peak = tracemalloc.get_traced_memory()[1]
+                memory[name] = max(memory.get(name, 0), peak - base)
+                memory['total'] = max(memory.get('total', 0), peak - first)
+
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+    return value
+
+
+def ConvertFile(inPath, outPath, cache=None, timings=None, cancel=None, yaz0Level=None, memory=None,
+                memoryBudget=None):
+    """
+    Converts the NSMBW level file inPath and writes the NSMBU level to outPath,
+    compressed to Yaz0 if yaz0Level is given.
+    If cache (a cache.ConversionCache) already has the output, it is used instead.
+    timings, cancel, memory and memoryBudget are passed to ConvertBytes.
+    Returns True if the output came from the cache.
+    """
+    with open(inPath, 'rb') as inf:
+        inData = inf.read()
+
+    if cache is not None:
+        version = TablesVersion()
+        if yaz0Level is not None:
+            version += '-yaz0-%d' % yaz0Level
+
+        key = cache.key(inData, version)
+        data = cache.get(key)
+        if data is not None:
+            with open(outPath, 'wb') as out:
+                out.write(data)
+
+            return True
+
+    data = ConvertBytes(inData, timings, cancel, yaz0Level, memory, memoryBudget)
+
+    if cache is not None:
+        cache.put(key, data)
+
+    with open(outPath, 'wb') as out:
+        out.write(data)
+
+    return False
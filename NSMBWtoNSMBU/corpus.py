@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Generates synthetic NSMBW levels, for benchmarks and tests
+# without shipping real game levels
+
+import archive
+import argparse
+import lh
+import os
+import random
+import struct
+
+# Size tiers for the benchmarks, as MakeLevel arguments
+TIERS = {
+    'small': dict(areas=1, objects=200, sprites=50, zones=2, entrances=4, locations=4, pathNodes=8),
+    'medium': dict(areas=2, objects=2000, sprites=300, zones=4, entrances=12, locations=16, pathNodes=48),
+    'large': dict(areas=4, objects=10000, sprites=1500, zones=8, entrances=32, locations=64, pathNodes=192),
+}
+
+TILESETS = ('Pa0_jyotyu', 'Pa1_nohara', 'Pa2_doukutu', 'Pa3_rail')
+
+# Nodes per path
+PATH_LENGTH = 8
+
+# Layers that get objects, in order of use
+LAYER_ORDER = (1, 0, 2)
+
+blockHeader = struct.Struct('>II')
+optStruct = struct.Struct('>IxxxxHh?BxxB?Bx')
+opt2Struct = struct.Struct('>xxHHxx')
+bdngStruct = struct.Struct('>llllHHxxxx')
+bgStruct = struct.Struct('>xBhhhhHHHxxxBxxxx')
+entStruct = struct.Struct('>HHxxxxBBBBxBBBHxB')
+sprStruct = struct.Struct('>HHH8sxx')
+loadedStruct = struct.Struct('>Hxx')
+zoneStruct = struct.Struct('>HHHHHHBBBBxBBBBxBB')
+locStruct = struct.Struct('>HHHHBxxx')
+pathStruct = struct.Struct('>BxHHH')
+nodeStruct = struct.Struct('>HHffhxx')
+objStruct = struct.Struct('>HHHHH')
+
+
+def MakeZones(rng, count):
+    """
+    Returns count zones as (x, y, width, height), side by side
+    """
+    zones = []
+    x = 256
+    for i in range(count):
+        width = rng.randrange(400, 2000, 16)
+        height = rng.randrange(240, 800, 16)
+        zones.append((x, rng.randrange(256, 1024, 16), width, height))
+        x += width + rng.randrange(64, 512, 16)
+
+    return zones
+
+
+def RandomPoint(rng, zone):
+    """
+    Returns a random point in zone
+    """
+    x, y, width, height = zone
+    return rng.randrange(x, x + width), rng.randrange(y, y + height)
+
+
+def MakeCourse(rng, zones=2, sprites=50, entrances=4, locations=4, pathNodes=8):
+    """
+    Returns the contents of a NSMBW course file with the given amount of things
+    """
+    rects = MakeZones(rng, max(zones, 1))
+    blocks = [b''] * 14
+
+    # Block 1: tileset names
+    blocks[0] = b''.join(name.encode('utf-8').ljust(32, b'\0') for name in TILESETS)
+
+    # Blocks 2 and 4: options
+    blocks[1] = optStruct.pack(rng.getrandbits(32), 0, rng.randrange(100, 500), False, 0, 0, False, 0)
+    blocks[3] = opt2Struct.pack(0, 0)
+
+    # Block 3: boundings, and blocks 5 and 6: backgrounds, one of each per zone
+    blocks[2] = b''.join(bdngStruct.pack(rng.randrange(-64, 64), rng.randrange(-64, 64), rng.randrange(-64, 64),
+                                         rng.randrange(-64, 64), i, rng.randrange(16)) for i in range(zones))
+    blocks[4] = b''.join(bgStruct.pack(i, 0, 0, 0, 0, rng.randrange(16), rng.randrange(16), rng.randrange(16), 0)
+                         for i in range(zones))
+    blocks[5] = b''.join(bgStruct.pack(i, 0, 0, 0, 0, rng.randrange(16), rng.randrange(16), rng.randrange(16), 0)
+                         for i in range(zones))
+
+    # Block 7: entrances
+    data = bytearray()
+    for i in range(entrances):
+        x, y = RandomPoint(rng, rng.choice(rects))
+        data += entStruct.pack(x, y, i, 0, rng.randrange(entrances), rng.randrange(28), rng.randrange(zones or 1),
+                               rng.randrange(2), 0, 0, 0)
+    blocks[6] = bytes(data)
+
+    # Block 8: sprites, and block 9: the sprite types to load
+    data = bytearray()
+    types = set()
+    for i in range(sprites):
+        type = rng.randrange(483)
+        x, y = RandomPoint(rng, rng.choice(rects))
+        data += sprStruct.pack(type, x, y, bytes(rng.getrandbits(8) for _ in range(8)))
+        types.add(type)
+    blocks[7] = bytes(data) + b'\xFF\xFF\xFF\xFF'
+    blocks[8] = b''.join(loadedStruct.pack(type) for type in sorted(types))
+
+    # Block 10: zones
+    blocks[9] = b''.join(zoneStruct.pack(x, y, width, height, 0, 0, i, i, 0, 0, 0, i, i, 0, rng.randrange(32), 0)
+                         for i, (x, y, width, height) in enumerate(rects[:zones]))
+
+    # Block 11: locations
+    data = bytearray()
+    for i in range(locations):
+        x, y = RandomPoint(rng, rng.choice(rects))
+        data += locStruct.pack(x, y, rng.randrange(16, 256), rng.randrange(16, 256), i)
+    blocks[10] = bytes(data)
+
+    # Blocks 13 and 14: paths and their nodes
+    paths = bytearray()
+    nodes = bytearray()
+    for start in range(0, pathNodes, PATH_LENGTH):
+        count = min(PATH_LENGTH, pathNodes - start)
+        paths += pathStruct.pack(start // PATH_LENGTH, start, count, rng.choice((0, 2)))
+
+        x, y = RandomPoint(rng, rng.choice(rects))
+        for i in range(count):
+            nodes += nodeStruct.pack(x, y, rng.choice((0.5, 1.0, 2.0)), rng.choice((0.0, 0.0625)), 0)
+            x = min(x + rng.randrange(0, 128), 0xFFFF)
+            y = max(y + rng.randrange(-64, 64), 0)
+    blocks[12] = bytes(paths)
+    blocks[13] = bytes(nodes)
+
+    # The blocks go right after the 14 block headers
+    course = bytearray(0x70)
+    offset = 0x70
+    for i, block in enumerate(blocks):
+        blockHeader.pack_into(course, i * 8, offset, len(block))
+        course += block
+        offset += len(block)
+
+    return bytes(course)
+
+
+def MakeLayer(rng, objects):
+    """
+    Returns the contents of a NSMBW layer file with the given amount of objects
+    """
+    data = bytearray(objects * objStruct.size + 2)
+    for i in range(objects):
+        tileset = rng.choice((0, 0, 0, 1, 1, 2, 3))
+        objStruct.pack_into(data, i * objStruct.size, (tileset << 12) | rng.randrange(100),
+                            rng.randrange(4096), rng.randrange(512), rng.randrange(1, 32), rng.randrange(1, 16))
+
+    data[-2:] = b'\xFF\xFF'
+    return bytes(data)
+
+
+def MakeLevel(seed=0, areas=1, objects=200, layers=1, sprites=50, zones=2, entrances=4, locations=4,
+              pathNodes=8, compress=None):
+    """
+    Returns the contents of a NSMBW level file, the same for the same arguments.
+    objects is per layer, and every area gets the given amount of things.
+    If compress is given, the level is LH compressed at that level.
+    """
+    if not 1 <= areas <= 4:
+        raise ValueError('A level has 1 to 4 areas')
+
+    if not 0 <= layers <= 3:
+        raise ValueError('An area has 0 to 3 layers')
+
+    rng = random.Random(seed)
+
+    arc = archive.U8()
+    arc['course'] = None
+    for area in range(1, areas + 1):
+        arc['course/course%d.bin' % area] = MakeCourse(rng, zones, sprites, entrances, locations, pathNodes)
+
+        for layer in LAYER_ORDER[:layers]:
+            arc['course/course%d_bgdatL%d.bin' % (area, layer)] = MakeLayer(rng, objects)
+
+    data = arc._dump()
+    if compress is not None:
+        data = lh.CompressLH(data, compress)
+
+    return data
+
+
+def WriteCorpus(outDir, count, seed=0, **kwargs):
+    """
+    Writes count levels made by MakeLevel to outDir, with seeds from seed on.
+    Returns their paths.
+    """
+    os.makedirs(outDir, exist_ok=True)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(outDir, 'synthetic-%03d.arc' % i)
+        with open(path, 'wb') as out:
+            out.write(MakeLevel(seed + i, **kwargs))
+
+        paths.append(path)
+
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Writes synthetic NSMBW levels.')
+    parser.add_argument('output', help='folder to write the .arc files to')
+    parser.add_argument('-n', '--count', type=int, default=1, help='number of levels (default: 1)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='seed of the first level (default: 0)')
+    parser.add_argument('-t', '--tier', choices=sorted(TIERS), default='small', help='base sizes (default: small)')
+    parser.add_argument('--areas', type=int, help='areas per level')
+    parser.add_argument('--objects', type=int, help='objects per layer')
+    parser.add_argument('--layers', type=int, default=1, help='layers per area (default: 1)')
+    parser.add_argument('--sprites', type=int, help='sprites per area')
+    parser.add_argument('--zones', type=int, help='zones per area')
+    parser.add_argument('--entrances', type=int, help='entrances per area')
+    parser.add_argument('--locations', type=int, help='locations per area')
+    parser.add_argument('--path-nodes', dest='pathNodes', type=int, help='path nodes per area')
+    parser.add_argument('--lh', type=int, nargs='?', const=6, metavar='LEVEL',
+                        help='compress the levels to LH, at LEVEL 0-9 (default: 6)')
+    args = parser.parse_args(argv)
+
+    sizes = dict(TIERS[args.tier])
+    for name in sizes:
+        value = getattr(args, name)
+        if value is not None:
+            sizes[name] = value
+
+    for path in WriteCorpus(args.output, args.count, args.seed, layers=args.layers, compress=args.lh, **sizes):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Instrumentation of the conversion stages.
+# Code wraps its stages in Span(name) and counts what they process;
+# the spans go to the current sink, which does nothing by default.
+
+import json
+import math
+import time
+
+
+class NullSink:
+    """
+    Sink that drops everything. Spans are not even timed with it.
+    """
+    enabled = False
+
+    def record(self, name, seconds, counters):
+        pass
+
+
+class JSONLSink:
+    """
+    Sink that writes every span as a line of JSON to a file.
+    The lines are small single writes, so several processes can append to the same file.
+    """
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', buffering=1)
+
+    def record(self, name, seconds, counters):
+        self.file.write(json.dumps({'span': name, 'time': time.time(), 'seconds': seconds, 'counters': counters}) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class AggregateSink:
+    """
+    Sink that keeps the durations and counter totals of every span name in memory
+    """
+    enabled = True
+
+    def __init__(self):
+        self.durations = {}  # span name -> list of seconds
+        self.counters = {}  # span name -> {counter name: total}
+
+    def record(self, name, seconds, counters):
+        self.durations.setdefault(name, []).append(seconds)
+
+        if counters:
+            totals = self.counters.setdefault(name, {})
+            for counter, value in counters.items():
+                totals[counter] = totals.get(counter, 0) + value
+
+    def merge(self, durations, counters):
+        """
+        Adds the durations and counters of another AggregateSink, e.g. from a worker process
+        """
+        for name, seconds in durations.items():
+            self.durations.setdefault(name, []).extend(seconds)
+
+        for name, values in counters.items():
+            totals = self.counters.setdefault(name, {})
+            for counter, value in values.items():
+                totals[counter] = totals.get(counter, 0) + value
+
+    def report(self, bins=8, width=40):
+        """
+        Returns a text report with a histogram of the durations of every span name
+        """
+        lines = []
+        for name in sorted(self.durations, key=lambda name: -sum(self.durations[name])):
+            seconds = sorted(self.durations[name])
+            total = sum(seconds)
+            lines.append('%s: %d spans, %s total, %s mean, %s p50, %s p90, %s max' % (
+                name, len(seconds), FormatSeconds(total), FormatSeconds(total / len(seconds)),
+                FormatSeconds(Percentile(seconds, 50)), FormatSeconds(Percentile(seconds, 90)),
+                FormatSeconds(seconds[-1])))
+
+            counters = self.counters.get(name)
+            if counters:
+                lines.append('    ' + ', '.join('%s: %d (%.0f/s)' % (counter, value, value / total if total else 0)
+                                                for counter, value in sorted(counters.items())))
+
+            lines.extend('    ' + line for line in Histogram(seconds, bins, width))
+            lines.append('')
+
+        return '\n'.join(lines)
+
+
+def FormatSeconds(seconds):
+    """
+    Returns seconds as a short string in a fitting unit
+    """
+    if seconds >= 1:
+        return '%.2fs' % seconds
+
+    if seconds >= 1e-3:
+        return '%.2fms' % (seconds * 1e3)
+
+    return '%.1fus' % (seconds * 1e6)
+
+
+def Percentile(values, percent):
+    """
+    Returns the given percentile of the sorted list values
+    """
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+def Histogram(values, bins=8, width=40):
+    """
+    Returns the lines of a text histogram of the sorted list of seconds values,
+    with logarithmic bins
+    """
+    low = max(values[0], 1e-7)
+    high = max(values[-1], low)
+    if high <= low * 1.01:
+        return ['%10s |%s %d' % (FormatSeconds(low), '#' * width, len(values))]
+
+    step = math.log(high / low) / bins
+    counts = [0] * bins
+    for value in values:
+        counts[min(bins - 1, int(math.log(max(value, low) / low) / step))] += 1
+
+    most = max(counts)
+    lines = []
+    for i, count in enumerate(counts):
+        lines.append('%10s |%s %d' % (FormatSeconds(low * math.exp(step * (i + 1))),
+                                      '#' * (count * width // most), count))
+
+    return lines
+
+
+class _NullSpan:
+    """
+    Span used when the sink is disabled, which does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def count(self, name, value=1):
+        pass
+
+
+class _Span:
+    """
+    Span that times its block and sends it to the sink with its counters
+    """
+    __slots__ = ('name', 'counters', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.counters = {}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _sink.record(self.name, time.perf_counter() - self.start, self.counters)
+        return False
+
+    def __bool__(self):
+        return True
+
+    def count(self, name, value=1):
+        """
+        Adds value to the counter called name
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+_NULL_SPAN = _NullSpan()
+_sink = NullSink()
+
+
+def Span(name):
+    """
+    Returns a context manager timing its block as a span called name.
+    Spans are false when the sink is disabled, so counts that are costly
+    to compute can be skipped with "if span:".
+    """
+    if _sink.enabled:
+        return _Span(name)
+
+    return _NULL_SPAN
+
+
+def GetSink():
+    return _sink
+
+
+def SetSink(sink):
+    """
+    Sets the sink the spans go to, None for none. Returns the previous one.
+    """
+    global _sink
+    previous = _sink
+    _sink = NullSink() if sink is None else sink
+    return previous
@@ -19,10 +19,122 @@ class QRectF:
         return self.y + self.h
 
     def contains(self, x, y):
-        if x in range(self.x, self.x + self.w) and y in range(self.y, self.y + self.h):
-            return True
+        return self.x <= x < self.x + self.w and self.y <= y < self.y + self.h
 
-        return False
+
+class TrackedList(list):
+    """
+    List that remembers whether it was changed, for saving only what changed.
+    Changes to the items themselves aren't seen.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.dirty = True
+
+
+def _trackedMethod(name):
+    method = getattr(list, name)
+
+    def tracked(self, *args, **kwargs):
+        self.dirty = True
+        return method(self, *args, **kwargs)
+
+    tracked.__name__ = name
+    return tracked
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__',
+              'append', 'clear', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(TrackedList, _name, _trackedMethod(_name))
+
+del _name
+
+
+class ZoneIndex:
+    """
+    Uniform grid over the rects of a list of zones,
+    for finding the zone containing or nearest a position
+    """
+    GRID_SIZE = 32  # Cells along each axis
+
+    def __init__(self, zones):
+        """
+        Builds the grid for zones
+        """
+        self.rects = []  # (left, top, right, bottom, zone id)
+        for zone in zones:
+            r = zone.ZoneRect
+            self.rects.append((r.left(), r.top(), r.right(), r.bottom(), zone.id))
+
+        self.cells = {}  # (column, row) -> indexes of the zones overlapping that cell, in order
+        self.cache = {}  # (x, y) -> result of lookup()
+
+        if not self.rects:
+            return
+
+        self.left = min(rect[0] for rect in self.rects)
+        self.top = min(rect[1] for rect in self.rects)
+        self.cellWidth = max(-(-(max(rect[2] for rect in self.rects) - self.left) // self.GRID_SIZE), 1)
+        self.cellHeight = max(-(-(max(rect[3] for rect in self.rects) - self.top) // self.GRID_SIZE), 1)
+
+        for i, (left, top, right, bottom, id) in enumerate(self.rects):
+            if right <= left or bottom <= top:
+                continue  # Empty, can't contain anything
+
+            for row in range((top - self.top) // self.cellHeight, (bottom - 1 - self.top) // self.cellHeight + 1):
+                for column in range((left - self.left) // self.cellWidth, (right - 1 - self.left) // self.cellWidth + 1):
+                    self.cells.setdefault((column, row), []).append(i)
+
+    def lookup(self, x, y):
+        """
+        Returns (index, id) of the first zone containing the position.
+        If no zone contains it, index is -1 and id is the one of the nearest zone
+        (or -1 if there are no zones).
+        """
+        key = (x, y)
+        if key in self.cache:
+            return self.cache[key]
+
+        rects = self.rects
+        result = None
+
+        if self.cells:
+            for i in self.cells.get(((x - self.left) // self.cellWidth, (y - self.top) // self.cellHeight), ()):
+                left, top, right, bottom, id = rects[i]
+                if left <= x < right and top <= y < bottom:
+                    result = (i, id)
+                    break
+
+        if result is None:
+            minimumdist = -1
+            rval = -1
+
+            for left, top, right, bottom, id in rects:
+                xdist = 0
+                ydist = 0
+                if x <= left: xdist = left - x
+                if x >= right: xdist = x - right
+                if y <= top: ydist = top - y
+                if y >= bottom: ydist = y - bottom
+
+                # No need for the square root just to compare the distances
+                dist = xdist ** 2 + ydist ** 2
+                if dist < minimumdist or minimumdist == -1:
+                    minimumdist = dist
+                    rval = id
+
+            result = (-1, rval)
+
+        self.cache[key] = result
+        return result
+
+    def lookupAll(self, points):
+        """
+        Returns the lookup() results for a list of (x, y) positions
+        """
+        lookup = self.lookup
+        return [lookup(x, y) for x, y in points]
 
 
 class ObjectItem:
@@ -41,9 +153,13 @@ class ObjectItem:
 
 
 class ZoneItem:
+    BOUNDING_ATTRS = ('yupperbound', 'ylowerbound', 'yupperbound2', 'ylowerbound2', 'entryid', 'unknownbnf')
+
     def __init__(self, a, b, c, d, e, f, g, h, i, j, k, l, m, n, o, p, bounding, bgA, bgB, id=None):
         """
-        Creates a zone with specific data
+        Creates a zone with specific data.
+        bounding, bgA and bgB can be functions returning them,
+        which are only called when they are first accessed.
         """
         self.objx = a
         self.objy = b
@@ -57,6 +173,7 @@ class ZoneItem:
         self.camzoom = j
         self.visibility = k
         self.block5id = l
+        self.block6id = m
         self.camtrack = n
         self.music = o
         self.sfxmod = p
@@ -64,24 +181,37 @@ class ZoneItem:
         if id is not None:
             self.id = id
 
-        if bounding:
-            self.yupperbound = bounding[0]
-            self.ylowerbound = bounding[1]
-            self.yupperbound2 = bounding[2]
-            self.ylowerbound2 = bounding[3]
-            self.entryid = bounding[4]
-            self.unknownbnf = bounding[5]
-
-        else:
-            self.yupperbound = 0
-            self.ylowerbound = 0
-            self.yupperbound2 = 0
-            self.ylowerbound2 = 0
-            self.entryid = 0
-            self.unknownbnf = 0
+        self._bounding = bounding
+        self._bgA = bgA
+        self._bgB = bgB
 
         self.ZoneRect = QRectF(self.objx, self.objy, self.width, self.height)
 
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set yet
+        attrs = self.__dict__
+
+        if name in ZoneItem.BOUNDING_ATTRS and '_bounding' in attrs:
+            bounding = attrs.pop('_bounding')
+            if callable(bounding):
+                bounding = bounding()
+
+            values = bounding[:6] if bounding else (0,) * 6
+            for attr, value in zip(ZoneItem.BOUNDING_ATTRS, values):
+                attrs.setdefault(attr, value)
+
+            return attrs[name]
+
+        if name in ('bgA', 'bgB') and '_' + name in attrs:
+            bg = attrs.pop('_' + name)
+            if callable(bg):
+                bg = bg()
+
+            attrs[name] = bg
+            return bg
+
+        raise AttributeError(name)
+
 
 class LocationItem:
     def __init__(self, x, y, width, height, id):
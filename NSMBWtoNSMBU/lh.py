@@ -4,10 +4,16 @@
 # Based on:
 # https://github.com/Treeki/RandomStuff/blob/master/LHDecompressor.cpp
 
+import heapq
+
+from common import align, LZTokens
+
 
 class LHContext:
-    buf1 = bytearray(0x800)
-    buf2 = bytearray(0x80)
+    def __init__(self):
+        # Huffman trees of the literals/lengths and of the distances
+        self.buf1 = bytearray(0x800)
+        self.buf2 = bytearray(0x80)
 
 
 def GetUncompressedSize(inData):
@@ -65,11 +71,68 @@ def LoadLHPiece(buf, inData, unk):
     return copiedAmount
 
 
+def BuildLHTable(buf, tableBits, leafFlag, offsetMask):
+    """
+    Builds a lookup table for the tree loaded by LoadLHPiece.
+    Every entry is indexed by the next tableBits bits of the stream
+    and holds (value, bit count, is leaf). For leaves, value is the
+    decoded symbol. For codes longer than tableBits, value is the
+    offset into buf of the node to continue walking from.
+    """
+    table = [None] * (1 << tableBits)
+    stack = [(2, 0, 0)]  # (offset into buf, code, code length)
+
+    while stack:
+        node, code, depth = stack.pop()
+        shift = tableBits - depth
+        if not shift:
+            table[code] = (node, depth, False)
+            continue
+
+        try:
+            r11 = (buf[node] << 8) | buf[node + 1]
+
+        except IndexError:
+            # Let the bit walk hit the broken node, like the original would
+            for i in range(code << shift, (code + 1) << shift):
+                table[i] = (node, depth, False)
+
+            continue
+
+        for bit in range(2):
+            child = (node & ~3) + ((bit + (((r11 & offsetMask) + 1) << 1)) << 1)
+            childCode = (code << 1) | bit
+
+            if r11 & (leafFlag >> bit):
+                shift = tableBits - depth - 1
+                try:
+                    entry = ((buf[child] << 8) | buf[child + 1], depth + 1, True)
+
+                except IndexError:
+                    entry = (node, depth, False)
+
+                for i in range(childCode << shift, (childCode + 1) << shift):
+                    table[i] = entry
+
+            else:
+                stack.append((child, childCode, depth + 1))
+
+    return table
+
+
 def IsLHCompressed(inData):
-    return inData.startswith(b'@')
+    return inData[:1] == b'@'
+
 
+def UncompressLH(inData, tables=True):
+    """
+    Decompresses LH data.
+    If tables is True, the Huffman trees are decoded through lookup tables,
+    otherwise they are walked one bit at a time. Both give the same output.
+    """
+    if tables:
+        return UncompressLHTable(inData)
 
-def UncompressLH(inData):
     context = LHContext()
 
     outLength = GetUncompressedSize(inData)
@@ -213,3 +276,707 @@ def UncompressLH(inData):
                 break
 
     return bytes(outData)
+
+
+def UncompressLHTable(inData):
+    """
+    Table driven version of UncompressLH
+    """
+    context = LHContext()
+    buf1 = context.buf1
+    buf2 = context.buf2
+
+    outSize = GetUncompressedSize(inData)
+    outData = bytearray(outSize)
+    outIndex = 0
+
+    pos = 4
+    if not (inData[1] | (inData[2] << 8) | (inData[3] << 16)):
+        pos = 8
+
+    pos += LoadLHPiece(buf1, memoryview(inData)[pos:], 9)
+    pos += LoadLHPiece(buf2, memoryview(inData)[pos:], 5)
+    end = len(inData)
+
+    litBits = 9
+    litMask = (1 << litBits) - 1
+    litTable = BuildLHTable(buf1, litBits, 0x100, 0x7F)
+
+    distBits = 5
+    distMask = (1 << distBits) - 1
+    distTable = BuildLHTable(buf2, distBits, 0x10, 7)
+
+    # Bits are read MSB first; past the end of the input we pad with zeros,
+    # and only fail if those padding bits actually got consumed
+    bitbuf = 0
+    bitcnt = 0
+
+    while outIndex < outSize:
+        while bitcnt < litBits:
+            bitbuf = ((bitbuf << 8) | (inData[pos] if pos < end else 0)) & 0xFFFFFFFF
+            bitcnt += 8
+            pos += 1
+
+        r7, length, leaf = litTable[(bitbuf >> (bitcnt - litBits)) & litMask]
+        bitcnt -= length
+
+        if not leaf:
+            node = r7
+            while True:
+                if not bitcnt:
+                    bitbuf = inData[pos] if pos < end else 0
+                    bitcnt = 8
+                    pos += 1
+
+                bitcnt -= 1
+                bit = (bitbuf >> bitcnt) & 1
+                r11 = (buf1[node] << 8) | buf1[node + 1]
+                child = (node & ~3) + ((bit + (((r11 & 0x7F) + 1) << 1)) << 1)
+                if r11 & (0x100 >> bit):
+                    r7 = (buf1[child] << 8) | buf1[child + 1]
+                    break
+
+                node = child
+
+        if r7 < 0x100:
+            outData[outIndex] = r7
+            outIndex += 1
+            continue
+
+        r7 = (r7 & 0xFF) + 3
+
+        while bitcnt < distBits:
+            bitbuf = ((bitbuf << 8) | (inData[pos] if pos < end else 0)) & 0xFFFFFFFF
+            bitcnt += 8
+            pos += 1
+
+        r11, length, leaf = distTable[(bitbuf >> (bitcnt - distBits)) & distMask]
+        bitcnt -= length
+
+        if not leaf:
+            node = r11
+            while True:
+                if not bitcnt:
+                    bitbuf = inData[pos] if pos < end else 0
+                    bitcnt = 8
+                    pos += 1
+
+                bitcnt -= 1
+                bit = (bitbuf >> bitcnt) & 1
+                r12 = (buf2[node] << 8) | buf2[node + 1]
+                child = (node & ~3) + ((bit + (((r12 & 7) + 1) << 1)) << 1)
+                if r12 & (0x10 >> bit):
+                    r11 = (buf2[child] << 8) | buf2[child + 1]
+                    break
+
+                node = child
+
+        r10 = 0
+        if r11:
+            # r11 - 1 extra bits follow, the distance is only 16 bits wide
+            r10 = 1
+            r11 -= 1
+            while r11:
+                n = r11 if r11 < 16 else 16
+                while bitcnt < n:
+                    bitbuf = ((bitbuf << 8) | (inData[pos] if pos < end else 0)) & 0xFFFFFFFF
+                    bitcnt += 8
+                    pos += 1
+
+                bitcnt -= n
+                r10 = ((r10 << n) | ((bitbuf >> bitcnt) & ((1 << n) - 1))) & 0xFFFF
+                r11 -= n
+
+        if (outIndex + r7) > outSize:
+            r7 = outSize - outIndex
+
+        r10 = (r10 + 1) & 0xFFFF
+        r9 = outIndex - r10
+
+        if r9 < 0 or not r10:
+            # Invalid distance, copy the same way as the original decoder
+            for i in range(r7):
+                outData[outIndex] = outData[outIndex - r10]
+                outIndex += 1
+
+        elif r10 >= r7:
+            outData[outIndex:outIndex + r7] = outData[r9:r9 + r7]
+            outIndex += r7
+
+        else:
+            # Overlapping copy, repeat the pattern
+            pattern = outData[r9:outIndex]
+            for i in range(r7 // r10):
+                outData[outIndex:outIndex + r10] = pattern
+                outIndex += r10
+
+            r7 %= r10
+            outData[outIndex:outIndex + r7] = pattern[:r7]
+            outIndex += r7
+
+    if (pos - end) << 3 > bitcnt:
+        raise IndexError('LH data is truncated')
+
+    return bytes(outData)
+
+
+class LHDecompressor:
+    """
+    Incremental LH decompressor.
+    Compressed data is given in chunks of any size through decompress(),
+    which returns the output decoded so far. Without an output buffer,
+    only a window of the output is kept for back references.
+    """
+
+    # Back references reach up to 0xFFFF bytes back
+    WINDOW_SIZE = 0x10000
+    CHUNK_SIZE = 0x10000
+
+    NEED_INPUT = 0
+    FLUSH = 1
+
+    def __init__(self, out=None):
+        """
+        Creates the decompressor.
+        If out is given, the output is decoded straight into it
+        (a bytearray or writable memoryview big enough for the whole output).
+        """
+        self.out = out
+        self.outSize = None
+        self.outIndex = 0
+        self.eof = False
+
+        self._inBuf = bytearray()
+        self._base = 0  # Output position of the start of the window
+        self._flushed = 0  # Output position up to which output was returned
+
+        if out is None:
+            self._outData = bytearray(self.WINDOW_SIZE + self.CHUNK_SIZE)
+
+        else:
+            self._outData = out
+
+        self._decoder = self._decode()
+
+    def decompress(self, data):
+        """
+        Feeds compressed data to the decompressor and returns the output
+        it produced. If decoding into a given buffer, the output is returned
+        as a memoryview of that buffer.
+        """
+        if self.eof:
+            if data:
+                raise ValueError('LH data is already fully decompressed')
+
+            return b'' if self.out is None else memoryview(self.out)[self.outIndex:self.outIndex]
+
+        self._inBuf += data
+        chunks = []
+
+        for request in self._decoder:
+            if request == self.NEED_INPUT:
+                break
+
+            # The window is full, hand out the new output and slide it
+            chunks.append(self._take())
+
+            keep = self.outIndex - self._base - self.WINDOW_SIZE
+            if keep > 0:
+                self._outData[:self.WINDOW_SIZE] = self._outData[keep:keep + self.WINDOW_SIZE]
+                self._base += keep
+
+        if self.out is not None:
+            start = self._flushed
+            self._flushed = self.outIndex
+            return memoryview(self.out)[start:self.outIndex]
+
+        chunks.append(self._take())
+        return b''.join(chunks)
+
+    def finish(self):
+        """
+        Checks that the compressed data was complete
+        """
+        if not self.eof:
+            raise IndexError('LH data is truncated')
+
+    def _take(self):
+        """
+        Returns the output that wasn't handed out yet from the window
+        """
+        start = self._flushed - self._base
+        end = self.outIndex - self._base
+        self._flushed = self.outIndex
+        return bytes(self._outData[start:end])
+
+    def _decode(self):
+        """
+        Decoding generator, yields NEED_INPUT when it ran out of input
+        and FLUSH when the output window is full
+        """
+        buf = self._inBuf
+        pos = 0
+
+        # Header
+        while len(buf) < 4:
+            yield self.NEED_INPUT
+
+        outSize = buf[1] | (buf[2] << 8) | (buf[3] << 16)
+        pos = 4
+        if not outSize:
+            while len(buf) < 8:
+                yield self.NEED_INPUT
+
+            outSize = buf[4] | (buf[5] << 8) | (buf[6] << 16) | (buf[7] << 24)
+            pos = 8
+
+        if self.out is not None and outSize > len(self.out):
+            raise ValueError('Output buffer is too small, need %d bytes' % outSize)
+
+        self.outSize = outSize
+
+        # Trees
+        context = LHContext()
+        buf1 = context.buf1
+        buf2 = context.buf2
+        for tree, unk in ((buf1, 9), (buf2, 5)):
+            while True:
+                # The piece is only complete once LoadLHPiece stops
+                # running out of bytes
+                try:
+                    pos += LoadLHPiece(tree, memoryview(buf)[pos:], unk)
+                    break
+
+                except IndexError:
+                    pass
+
+                yield self.NEED_INPUT
+
+        del buf[:pos]
+        pos = 0
+
+        litBits = 9
+        litMask = (1 << litBits) - 1
+        litTable = BuildLHTable(buf1, litBits, 0x100, 0x7F)
+
+        distBits = 5
+        distMask = (1 << distBits) - 1
+        distTable = BuildLHTable(buf2, distBits, 0x10, 7)
+
+        outData = self._outData
+        outIndex = 0
+        base = 0
+        bounded = self.out is None
+        room = len(outData)
+
+        # Bits are read MSB first. The tables are only used when enough
+        # bits are buffered, otherwise the trees are walked bit by bit
+        bitbuf = 0
+        bitcnt = 0
+
+        while outIndex < outSize:
+            if bounded and outIndex - base > room - 0x102:
+                self.outIndex = outIndex
+                yield self.FLUSH
+                base = self._base
+
+            while bitcnt < litBits and pos < len(buf):
+                bitbuf = ((bitbuf << 8) | buf[pos]) & 0xFFFFFFFF
+                bitcnt += 8
+                pos += 1
+
+            if bitcnt >= litBits:
+                r7, length, leaf = litTable[(bitbuf >> (bitcnt - litBits)) & litMask]
+                bitcnt -= length
+
+            else:
+                r7, leaf = 2, False
+
+            if not leaf:
+                node = r7
+                while True:
+                    while not bitcnt:
+                        if pos < len(buf):
+                            bitbuf = buf[pos]
+                            bitcnt = 8
+                            pos += 1
+
+                        else:
+                            del buf[:pos]
+                            pos = 0
+                            self.outIndex = outIndex
+                            yield self.NEED_INPUT
+
+                    bitcnt -= 1
+                    bit = (bitbuf >> bitcnt) & 1
+                    r11 = (buf1[node] << 8) | buf1[node + 1]
+                    child = (node & ~3) + ((bit + (((r11 & 0x7F) + 1) << 1)) << 1)
+                    if r11 & (0x100 >> bit):
+                        r7 = (buf1[child] << 8) | buf1[child + 1]
+                        break
+
+                    node = child
+
+            if r7 < 0x100:
+                outData[outIndex - base] = r7
+                outIndex += 1
+                continue
+
+            r7 = (r7 & 0xFF) + 3
+
+            while bitcnt < distBits and pos < len(buf):
+                bitbuf = ((bitbuf << 8) | buf[pos]) & 0xFFFFFFFF
+                bitcnt += 8
+                pos += 1
+
+            if bitcnt >= distBits:
+                r11, length, leaf = distTable[(bitbuf >> (bitcnt - distBits)) & distMask]
+                bitcnt -= length
+
+            else:
+                r11, leaf = 2, False
+
+            if not leaf:
+                node = r11
+                while True:
+                    while not bitcnt:
+                        if pos < len(buf):
+                            bitbuf = buf[pos]
+                            bitcnt = 8
+                            pos += 1
+
+                        else:
+                            del buf[:pos]
+                            pos = 0
+                            self.outIndex = outIndex
+                            yield self.NEED_INPUT
+
+                    bitcnt -= 1
+                    bit = (bitbuf >> bitcnt) & 1
+                    r12 = (buf2[node] << 8) | buf2[node + 1]
+                    child = (node & ~3) + ((bit + (((r12 & 7) + 1) << 1)) << 1)
+                    if r12 & (0x10 >> bit):
+                        r11 = (buf2[child] << 8) | buf2[child + 1]
+                        break
+
+                    node = child
+
+            r10 = 0
+            if r11:
+                # r11 - 1 extra bits follow, the distance is only 16 bits wide
+                r10 = 1
+                r11 -= 1
+                while r11:
+                    n = r11 if r11 < 16 else 16
+                    while bitcnt < n:
+                        if pos < len(buf):
+                            bitbuf = ((bitbuf << 8) | buf[pos]) & 0xFFFFFFFF
+                            bitcnt += 8
+                            pos += 1
+
+                        else:
+                            del buf[:pos]
+                            pos = 0
+                            self.outIndex = outIndex
+                            yield self.NEED_INPUT
+
+                    bitcnt -= n
+                    r10 = ((r10 << n) | ((bitbuf >> bitcnt) & ((1 << n) - 1))) & 0xFFFF
+                    r11 -= n
+
+            if (outIndex + r7) > outSize:
+                r7 = outSize - outIndex
+
+            r10 = (r10 + 1) & 0xFFFF
+            if not r10 or r10 > outIndex - base:
+                raise IndexError('LH distance is out of range')
+
+            # Byte by byte if the source overlaps with the destination
+            r9 = outIndex - base - r10
+            r8 = outIndex - base
+            if r10 >= r7:
+                outData[r8:r8 + r7] = outData[r9:r9 + r7]
+
+            else:
+                for i in range(r7):
+                    outData[r8 + i] = outData[r9 + i]
+
+            outIndex += r7
+
+        self.outIndex = outIndex
+        self.eof = True
+        del buf[:pos]
+
+
+def UncompressLHInto(inData, out):
+    """
+    Decompresses LH data straight into out, a bytearray or writable
+    memoryview big enough for the whole output.
+    Returns the size of the output.
+    """
+    decompressor = LHDecompressor(out)
+    decompressor.decompress(inData)
+    decompressor.finish()
+    return decompressor.outSize
+
+
+def IterUncompressLH(fileobj, chunkSize=0x10000):
+    """
+    Decompresses LH data read from a file object in chunks,
+    yielding the output as it is decoded
+    """
+    decompressor = LHDecompressor()
+    while not decompressor.eof:
+        data = fileobj.read(chunkSize)
+        if not data:
+            break
+
+        out = decompressor.decompress(data)
+        if out:
+            yield out
+
+    decompressor.finish()
+
+# Match finder settings for CompressLH, per level:
+# (max hash chain length, good enough match length, lazy matching)
+LH_LEVELS = (
+    (0, 0, False),
+    (4, 16, False),
+    (8, 32, False),
+    (16, 64, False),
+    (16, 32, True),
+    (32, 128, True),
+    (128, 258, True),
+    (256, 258, True),
+    (1024, 258, True),
+    (4096, 258, True),
+)
+
+LH_MIN_MATCH = 3
+LH_MAX_MATCH = 0xFF + 3
+LH_MAX_DISTANCE = 0x8000
+
+
+def LHCodeLengths(freqs, maxInternal):
+    """
+    Returns the code length of every used symbol, as a list of
+    (symbol, length) in tree order. Besides being a Huffman code, no level
+    of the tree may hold more than maxInternal internal nodes, or the child
+    offsets won't fit in the tree entries.
+    """
+    symbols = [sym for sym in range(len(freqs)) if freqs[sym]]
+    for sym in range(2):
+        # The tree needs at least two leaves
+        if len(symbols) < 2 and sym not in symbols:
+            symbols.append(sym)
+
+    # Plain Huffman code lengths first
+    heap = [(freqs[sym], i, [sym]) for i, sym in enumerate(symbols)]
+    heapq.heapify(heap)
+    huffLen = dict.fromkeys(symbols, 0)
+    tiebreak = len(heap)
+    while len(heap) > 1:
+        freq1, _, syms1 = heapq.heappop(heap)
+        freq2, _, syms2 = heapq.heappop(heap)
+        for sym in syms1 + syms2:
+            huffLen[sym] += 1
+
+        heapq.heappush(heap, (freq1 + freq2, tiebreak, syms1 + syms2))
+        tiebreak += 1
+
+    order = sorted(symbols, key=lambda sym: (huffLen[sym], -freqs[sym], sym))
+
+    # Then hand out the levels, moving leaves up or down where the
+    # Huffman code would break the width limit
+    lengths = []
+    remaining = len(order)
+    nodes = 2
+    depth = 1
+    while remaining:
+        index = len(lengths)
+        desired = 0
+        while index + desired < len(order) and huffLen[order[index + desired]] <= depth:
+            desired += 1
+
+        low = max(nodes - maxInternal, 2 * nodes - remaining, 0)
+        high = nodes if remaining == nodes else nodes - 1
+        leaves = min(max(desired, low), high)
+
+        for sym in order[index:index + leaves]:
+            lengths.append((sym, depth))
+
+        remaining -= leaves
+        nodes = (nodes - leaves) << 1
+        depth += 1
+
+    return lengths
+
+
+def BuildLHTree(lengths, bits):
+    """
+    Builds the tree entries read by LoadLHPiece from LHCodeLengths output.
+    Returns the entries (starting at the root) and the (code, length) of
+    every symbol.
+    """
+    leafFlag = 1 << (bits - 1)
+    offsetMask = (1 << (bits - 2)) - 1
+
+    entries = [0] * (len(lengths) * 2)
+    nodeEntry = [1]  # entry of every internal node, the root being the first
+    codes = {}
+
+    parents = [(0, 0)]  # (internal node index, code)
+    index = 0
+    depth = 1
+    while parents:
+        children = []
+        for j in range(len(parents) << 1):
+            parent, parentCode = parents[j >> 1]
+            bit = j & 1
+            code = (parentCode << 1) | bit
+            entry = ((parent + 1) << 1) | bit
+
+            if index < len(lengths) and lengths[index][1] == depth:
+                sym = lengths[index][0]
+                index += 1
+                entries[entry] = sym
+                entries[nodeEntry[parent]] |= leafFlag >> bit
+                codes[sym] = (code, depth)
+
+            else:
+                # Children of internal nodes are laid out breadth first
+                node = len(nodeEntry)
+                offset = node - parent - 1
+                if offset > offsetMask:
+                    raise ValueError('LH tree is too wide')
+
+                entries[entry] = offset
+                nodeEntry.append(entry)
+                children.append((node, code))
+
+        parents = children
+        depth += 1
+
+    return entries[1:], codes
+
+
+def PackLHPiece(entries, bits):
+    """
+    Packs tree entries the way LoadLHPiece expects them
+    """
+    body = bytearray()
+    acc = 0
+    accBits = 0
+    for value in entries:
+        acc = (acc << bits) | value
+        accBits += bits
+        while accBits >= 8:
+            accBits -= 8
+            body.append((acc >> accBits) & 0xFF)
+
+        acc &= (1 << accBits) - 1
+
+    if accBits:
+        body.append((acc << (8 - accBits)) & 0xFF)
+
+    headerSize = 1 if bits <= 8 else 2
+
+    # LoadLHPiece stops at the size given in the header, so pad until
+    # it reads back every entry and ends exactly at the end of the piece
+    size = align(headerSize + len(body) + 1, 4)
+    for i in range(16):
+        piece = bytearray(size)
+        piece[0] = ((size >> 2) - 1) & 0xFF
+        if headerSize == 2:
+            piece[1] = ((size >> 2) - 1) >> 8
+
+        piece[headerSize:headerSize + len(body)] = body
+
+        check = bytearray(4 << bits)
+        if LoadLHPiece(check, piece + bytes(4), bits) == size:
+            if all(((check[(i + 1) << 1] << 8) | check[((i + 1) << 1) + 1]) == value
+                   for i, value in enumerate(entries)):
+                return bytes(piece)
+
+        size += 4
+
+    raise ValueError('Could not pack LH tree')
+
+
+def CompressLH(inData, level=6):
+    """
+    Compresses data to LH.
+    Level 0 only stores literals, levels 1 to 9 trade speed for ratio.
+    """
+    if not 0 <= level < len(LH_LEVELS):
+        raise ValueError('LH compression level must be between 0 and %d' % (len(LH_LEVELS) - 1))
+
+    maxChain, niceLength, lazy = LH_LEVELS[level]
+
+    data = bytes(inData)
+    dataSize = len(data)
+
+    tokens = LZTokens(data, maxChain, niceLength, lazy, LH_MAX_MATCH, LH_MAX_DISTANCE)
+
+    # Build the trees
+    litFreqs = [0] * 0x200
+    distFreqs = [0] * 0x20
+    for token in tokens:
+        if token.__class__ is int:
+            litFreqs[token] += 1
+
+        else:
+            litFreqs[0x100 + token[0] - LH_MIN_MATCH] += 1
+            distFreqs[(token[1] - 1).bit_length()] += 1
+
+    litEntries, litCodes = BuildLHTree(LHCodeLengths(litFreqs, 0x80), 9)
+    distEntries, distCodes = BuildLHTree(LHCodeLengths(distFreqs, 8), 5)
+
+    # Header
+    out = bytearray(b'@')
+    if 0 < dataSize < 0x1000000:
+        out += dataSize.to_bytes(3, 'little')
+
+    else:
+        out += bytes(3) + dataSize.to_bytes(4, 'little')
+
+    out += PackLHPiece(litEntries, 9)
+    out += PackLHPiece(distEntries, 5)
+
+    # Bitstream, MSB first
+    acc = 0
+    accBits = 0
+    append = out.append
+    for token in tokens:
+        if token.__class__ is int:
+            code, codeLen = litCodes[token]
+            acc = (acc << codeLen) | code
+            accBits += codeLen
+
+        else:
+            length, distance = token
+            code, codeLen = litCodes[0x100 + length - LH_MIN_MATCH]
+            acc = (acc << codeLen) | code
+            accBits += codeLen
+
+            distance -= 1
+            extraLen = distance.bit_length()
+            code, codeLen = distCodes[extraLen]
+            acc = (acc << codeLen) | code
+            accBits += codeLen
+
+            if extraLen > 1:
+                extraLen -= 1
+                acc = (acc << extraLen) | (distance & ((1 << extraLen) - 1))
+                accBits += extraLen
+
+        while accBits >= 8:
+            accBits -= 8
+            append((acc >> accBits) & 0xFF)
+
+        acc &= (1 << accBits) - 1
+
+    if accBits:
+        append((acc << (8 - accBits)) & 0xFF)
+
+    return bytes(out)
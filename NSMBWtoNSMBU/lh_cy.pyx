@@ -4,26 +4,21 @@
 # Based on:
 # https://github.com/Treeki/RandomStuff/blob/master/LHDecompressor.cpp
 
-from cpython cimport array
-from cython cimport view
-from libc.stdlib cimport malloc, free
+# The input is taken through the buffer protocol (bytes, bytearray, mmap,
+# memoryview...) without being copied, and the GIL is released while
+# decoding, so several levels can be decompressed in parallel on threads.
 
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+from libc.string cimport memset
 
-ctypedef unsigned char u8
-ctypedef unsigned int u32
-
+from lh import CompressLH, LHDecompressor, IterUncompressLH
 
-cdef class LHContext:
-    cdef:
-        u8 *buf1
-        u8 *buf2
 
-    def __cinit__(self):
-        self.buf1 = <u8 *>malloc(0x800)
-        self.buf2 = <u8 *>malloc(0x80)
+ctypedef unsigned char u8
+ctypedef unsigned int u32
 
 
-cdef u32 GetUncompressedSize(u8 *inData):
+cdef u32 GetUncompressedSize(const u8 *inData) noexcept nogil:
     cdef u32 outSize = inData[1] | (inData[2] << 8) | (inData[3] << 16)
 
     if not outSize:
@@ -32,10 +27,13 @@ cdef u32 GetUncompressedSize(u8 *inData):
     return outSize
 
 
-cdef u32 LoadLHPiece(u8 *buf, u8 *inData, u8 unk):
+cdef u32 LoadLHPiece(u8 *buf, const u8 *inData, u32 inSize, u8 unk) noexcept nogil:
+    """
+    Returns the size of the piece, or 0 if it goes past inSize
+    """
     cdef:
         u32 r0, r4, r6, r7, r9, r10, r11, r12, r30
-        u32 inOffset, dataSize, copiedAmount
+        u32 inOffset, dataSize, copiedAmount, i
 
     r6 = 1 << unk
     r7 = 2
@@ -45,6 +43,9 @@ cdef u32 LoadLHPiece(u8 *buf, u8 *inData, u8 unk):
     r12 = r6 - 1
     r30 = r6 << 1
 
+    if inSize < 2:
+        return 0
+
     if unk <= 8:
         r6 = inData[0]
         inOffset = 1
@@ -60,6 +61,9 @@ cdef u32 LoadLHPiece(u8 *buf, u8 *inData, u8 unk):
         r6 = (r6 - r11) >> 3
 
         if r11 < unk:
+            if inOffset + r6 > inSize:
+                return 0
+
             for i in range(r6):
                 r4 = inData[inOffset]
                 r10 <<= 8
@@ -82,31 +86,161 @@ cdef u32 LoadLHPiece(u8 *buf, u8 *inData, u8 unk):
     return copiedAmount
 
 
+cdef void BuildLHTable(u32 *table, u8 *buf, u32 bufSize, u8 tableBits, u32 leafFlag, u32 offsetMask) noexcept nogil:
+    """
+    Builds a lookup table for the tree loaded by LoadLHPiece.
+    Every entry is indexed by the next tableBits bits of the stream
+    and holds (value << 8) | (is leaf << 7) | bit count. For leaves,
+    value is the decoded symbol. For codes longer than tableBits,
+    value is the offset into buf of the node to continue walking from.
+    """
+    cdef:
+        u32 stack[64 * 3]
+        u32 top = 0
+        u32 node, code, depth, shift, r11, bit, child, childCode, entry, i
+
+    stack[0] = 2; stack[1] = 0; stack[2] = 0
+    top = 3
+
+    while top:
+        top -= 3
+        node = stack[top]; code = stack[top + 1]; depth = stack[top + 2]
+        shift = tableBits - depth
+        if not shift:
+            table[code] = (node << 8) | depth
+            continue
+
+        if node + 1 >= bufSize:
+            # Let the bit walk hit the broken node, like the original would
+            for i in range(code << shift, (code + 1) << shift):
+                table[i] = (node << 8) | depth
+
+            continue
+
+        r11 = (buf[node] << 8) | buf[node + 1]
+
+        for bit in range(2):
+            child = (node & ~3) + ((bit + (((r11 & offsetMask) + 1) << 1)) << 1)
+            childCode = (code << 1) | bit
+
+            if r11 & (leafFlag >> bit):
+                shift = tableBits - depth - 1
+                if child + 1 < bufSize:
+                    entry = (((buf[child] << 8) | buf[child + 1]) << 8) | 0x80 | (depth + 1)
+
+                else:
+                    entry = (node << 8) | depth
+
+                for i in range(childCode << shift, (childCode + 1) << shift):
+                    table[i] = entry
+
+            else:
+                stack[top] = child; stack[top + 1] = childCode; stack[top + 2] = depth + 1
+                top += 3
+
+
 def IsLHCompressed(inData):
     return inData[:1] == b'@'
 
 
-cpdef bytes UncompressLH(data):
+cdef u32 GetLHDataSize(const u8[::1] data) except? 0:
+    """
+    Returns the uncompressed size, checking the header is all there
+    """
+    cdef u32 end = data.shape[0]
+
+    if end < 4 or (end < 8 and not (data[1] | data[2] | data[3])):
+        raise IndexError('LH data is truncated')
+
+    return GetUncompressedSize(&data[0])
+
+
+cdef int UncompressLHCore(const u8 *inData, u32 end, u8 *outData, u32 outSize, bint tables) noexcept nogil:
+    """
+    Decompresses LH data into outData.
+    Returns 0 on success, -1 if the data is truncated or corrupted.
+    """
     cdef:
-        array.array dataArr = array.array('B', data)
-        u8 *inData = dataArr.data.as_uchars
+        u8 buf1[0x800]
+        u8 buf2[0x80]
+        u32 pos = 4
+        u32 size
 
-        LHContext context = LHContext()
+    memset(buf1, 0, 0x800)
+    memset(buf2, 0, 0x80)
 
-        u32 outLength = GetUncompressedSize(inData)
-        u8 *outData = <u8 *>malloc(outLength)
+    if not (inData[1] | (inData[2] << 8) | (inData[3] << 16)):
+        pos = 8
 
-        u32 outIndex = 0
-        u32 outSize = inData[1] | (inData[2] << 8) | (inData[3] << 16)
+    size = LoadLHPiece(buf1, inData + pos, end - pos, 9)
+    if not size:
+        return -1
+
+    pos += size
+    size = LoadLHPiece(buf2, inData + pos, end - pos, 5)
+    if not size:
+        return -1
+
+    pos += size
+
+    if tables:
+        return UncompressLHTableCore(inData + pos, end - pos, outData, outSize, buf1, buf2)
+
+    return UncompressLHSerialCore(inData + pos, end - pos, outData, outSize, buf1, buf2)
 
-    inData += 4
+
+cpdef bytes UncompressLH(const u8[::1] data, bint tables=True):
+    """
+    Decompresses LH data.
+    If tables is True, the Huffman trees are decoded through lookup tables,
+    otherwise they are walked one bit at a time. Both give the same output.
+    """
+    cdef:
+        u32 outSize = GetLHDataSize(data)
+        bytes out = PyBytes_FromStringAndSize(NULL, outSize)
+        u8 *outData = <u8 *>PyBytes_AS_STRING(out)
+        int ret
+
+    with nogil:
+        ret = UncompressLHCore(&data[0], data.shape[0], outData, outSize, tables)
+
+    if ret:
+        raise IndexError('LH data is truncated or corrupted')
+
+    return out
+
+
+cpdef u32 UncompressLHInto(const u8[::1] data, u8[::1] out) except? 0:
+    """
+    Decompresses LH data straight into out, a bytearray or writable
+    memoryview big enough for the whole output.
+    Returns the size of the output.
+    """
+    cdef:
+        u32 outSize = GetLHDataSize(data)
+        int ret
+
+    if outSize > out.shape[0]:
+        raise ValueError('Output buffer is too small, need %d bytes' % outSize)
 
     if not outSize:
-        outSize = inData[0] | (inData[1] << 8) | (inData[2] << 16) | (inData[3] << 24)
-        inData += 4
+        return 0
+
+    with nogil:
+        ret = UncompressLHCore(&data[0], data.shape[0], &out[0], outSize, True)
 
-    inData += LoadLHPiece(context.buf1, inData, 9)
-    inData += LoadLHPiece(context.buf2, inData, 5)
+    if ret:
+        raise IndexError('LH data is truncated or corrupted')
+
+    return outSize
+
+
+cdef int UncompressLHSerialCore(const u8 *inData, u32 end, u8 *outData, u32 outSize, u8 *buf1, u8 *buf2) noexcept nogil:
+    """
+    Walks the trees one bit at a time
+    """
+    cdef:
+        u32 outIndex = 0
 
     # this is a direct conversion of the PPC ASM, pretty much
     cdef:
@@ -116,130 +250,282 @@ cpdef bytes UncompressLH(data):
         u32 r5 = 0
         u32 r6 = 0
         u32 r7, r8, r9, r10, r11, r12, r25
+        bint flag
+
+    while outIndex < outSize:
+        r12 = 2  # Used as an offset into buf1
+        r7 = r4  # Used as an offset into inData
+
+        while True:
+            if not r6:
+                if r7 >= end:
+                    return -1
+
+                r5 = inData[r7]
+                r6 = 8
+                r4 += 1
+                r7 += 1
+
+            if r12 + 1 >= 0x800:
+                return -1
+
+            r11 = (buf1[r12] << 8) | buf1[r12 + 1]
+            r8 = r5 >> (r6 - 1)
+            r6 -= 1
+
+            r9 = r8 & 1
+            r10 = r11 & 0x7F
+            r8 = r3 >> r9  # sraw?
+            r8 = r11 & r8
+            flag = not r8
+            r8 = (r10 + 1) << 1
+            r9 += r8
+
+            if flag:
+                r12 &= ~3
+                r8 = r9 << 1
+                r12 += r8
+                continue
+            else:
+                r8 = r12 & ~3  # offset into buf1
+                r7 = r9 << 1
+                if r8 + r7 + 1 >= 0x800:
+                    return -1
+
+                r7 = (buf1[r8 + r7] << 8) | buf1[r8 + r7 + 1]
+
+            break
+
+        if r7 < 0x100:
+            outData[outIndex] = r7
+            outIndex += 1
+            continue
+
+        # block copy?
+        r7 &= 0xFF
+        r25 = 2  # used as an offset into buf2
+        r7 += 3
+        r7 &= 0xFFFF  # r7 is really an ushort, probably
+        r8 = r4  # used as an offset into inData
+
+        while True:
+            if not r6:
+                if r8 >= end:
+                    return -1
+
+                r5 = inData[r8]
+                r6 = 8
+                r4 += 1
+                r8 += 1
+
+            if r25 + 1 >= 0x80:
+                return -1
+
+            r12 = (buf2[r25] << 8) | buf2[r25 + 1]
+            r9 = r5 >> (r6 - 1)
+            r6 -= 1
+            r10 = r9 & 1
+            r11 = r12 & 7
+            r9 = r0 >> r10  # sraw
+            r9 = r12 & r9
+            flag = not r9
+            r9 = r11 + 1
+            r9 <<= 1
+            r10 += r9
+
+            if flag:
+                r25 &= ~3
+                r9 = r10 << 1
+                r25 += r9
+                continue
+            else:
+                r9 = r25 & ~3
+                r8 = r10 << 1
+                if r9 + r8 + 1 >= 0x80:
+                    return -1
+
+                r11 = (buf2[r9 + r8] << 8) | buf2[r9 + r8 + 1]
+
+            break
 
-    try:
-        while outIndex < outSize:
-            r12 = 2  # Used as an offset into context.buf1
-            r7 = r4  # Used as an offset into inData
+        r10 = 0
+        if r11:
+            r8 = r4  # offset into inData
+            r10 = 1
 
             while True:
-                if not r6:
-                    r5 = inData[r7]
-                    r6 = 8
-                    r4 += 1
-                    r7 += 1
-
-                r11 = (context.buf1[r12] << 8) | context.buf1[r12 + 1]
-                r8 = r5 >> (r6 - 1)
-                r6 -= 1
-
-                r9 = r8 & 1
-                r10 = r11 & 0x7F
-                r8 = r3 >> r9  # sraw?
-                r8 = r11 & r8
-                flag = not r8
-                r8 = (r10 + 1) << 1
-                r9 += r8
-
-                if flag:
-                    r12 &= ~3
-                    r8 = r9 << 1
-                    r12 += r8
-                    continue
+                r11 -= 1
+                r9 = r11 & 0xFFFF
+                if r9:
+                    r10 = (r10 << 1) & 0xFFFF
+                    if not r6:
+                        if r8 >= end:
+                            return -1
+
+                        r5 = inData[r8]
+                        r6 = 8
+                        r4 += 1
+                        r8 += 1
+
+                    r6 -= 1
+                    r9 = r5 >> r6
+                    r9 &= 1
+                    r10 |= r9
                 else:
-                    r8 = r12 & ~3  # offset into buf1
-                    r7 = r9 << 1
-                    r7 = (context.buf1[r8 + r7] << 8) | context.buf1[r8 + r7 + 1]
+                    break
 
+        if (outIndex + r7) > outSize:
+            r7 = outSize - outIndex
+            r7 &= 0xFFFF
+
+        r9 = r10 + 1
+        r8 = outIndex  # offset into outData
+        r10 = r9 & 0xFFFF
+        if r10 > outIndex:
+            return -1
+
+        while True:
+            r9 = r7 & 0xFFFF
+            r7 -= 1
+            if r9:
+                r9 = outIndex - r10
+                outIndex += 1
+                outData[r8] = outData[r9]
+                r8 += 1
+            else:
                 break
 
-            if r7 < 0x100:
-                outData[outIndex] = r7
-                outIndex += 1
-                continue
+    return 0
+
+
+cdef int UncompressLHTableCore(const u8 *inData, u32 end, u8 *outData, u32 outSize, u8 *buf1, u8 *buf2) noexcept nogil:
+    """
+    Decodes the trees through lookup tables
+    """
+    cdef:
+        u32 outIndex = 0
+        u32 pos = 0
+
+        u32 litTable[1 << 9]
+        u32 distTable[1 << 5]
+        u8 litBits = 9
+        u8 distBits = 5
 
-            # block copy?
-            r7 &= 0xFF
-            r25 = 2  # used as an offset into context.buf2
-            r7 += 3
-            r7 &= 0xFFFF  # r7 is really an ushort, probably
-            r8 = r4  # used as an offset into inData
+        u32 bitbuf = 0
+        u32 bitcnt = 0
 
+        u32 r7, r9, r10, r11, r12, entry, node, bit, child, n, i
+
+    BuildLHTable(litTable, buf1, 0x800, litBits, 0x100, 0x7F)
+    BuildLHTable(distTable, buf2, 0x80, distBits, 0x10, 7)
+
+    # Bits are read MSB first; past the end of the input we pad with zeros,
+    # and only fail if those padding bits actually got consumed
+    while outIndex < outSize:
+        while bitcnt < litBits:
+            bitbuf = (bitbuf << 8) | (inData[pos] if pos < end else 0)
+            bitcnt += 8
+            pos += 1
+
+        entry = litTable[(bitbuf >> (bitcnt - litBits)) & ((1 << litBits) - 1)]
+        bitcnt -= entry & 0x7F
+        r7 = entry >> 8
+
+        if not entry & 0x80:
+            node = r7
             while True:
-                if not r6:
-                    r5 = inData[r8]
-                    r6 = 8
-                    r4 += 1
-                    r8 += 1
-
-                r12 = (context.buf2[r25] << 8) | context.buf2[r25 + 1]
-                r9 = r5 >> (r6 - 1)
-                r6 -= 1
-                r10 = r9 & 1
-                r11 = r12 & 7
-                r9 = r0 >> r10  # sraw
-                r9 = r12 & r9
-                flag = not r9
-                r9 = r11 + 1
-                r9 <<= 1
-                r10 += r9
-
-                if flag:
-                    r25 &= ~3
-                    r9 = r10 << 1
-                    r25 += r9
-                    continue
-                else:
-                    r9 = r25 & ~3
-                    r8 = r10 << 1
-                    r11 = (context.buf2[r9 + r8] << 8) | context.buf2[r9 + r8 + 1]
+                if not bitcnt:
+                    bitbuf = inData[pos] if pos < end else 0
+                    bitcnt = 8
+                    pos += 1
+
+                bitcnt -= 1
+                bit = (bitbuf >> bitcnt) & 1
+                if node + 1 >= 0x800:
+                    return -1
+
+                r11 = (buf1[node] << 8) | buf1[node + 1]
+                child = (node & ~3) + ((bit + (((r11 & 0x7F) + 1) << 1)) << 1)
+                if r11 & (0x100 >> bit):
+                    if child + 1 >= 0x800:
+                        return -1
+
+                    r7 = (buf1[child] << 8) | buf1[child + 1]
+                    break
 
-                break
+                node = child
+
+        if r7 < 0x100:
+            outData[outIndex] = r7
+            outIndex += 1
+            continue
+
+        r7 = (r7 & 0xFF) + 3
+
+        while bitcnt < distBits:
+            bitbuf = (bitbuf << 8) | (inData[pos] if pos < end else 0)
+            bitcnt += 8
+            pos += 1
 
-            r10 = 0
-            if r11:
-                r8 = r4  # offset into inData
-                r10 = 1
-
-                while True:
-                    r11 -= 1
-                    r9 = r11 & 0xFFFF
-                    if r9:
-                        r10 = (r10 << 1) & 0xFFFF
-                        if not r6:
-                            r5 = inData[r8]
-                            r6 = 8
-                            r4 += 1
-                            r8 += 1
-
-                        r6 -= 1
-                        r9 = r5 >> r6
-                        r9 &= 1
-                        r10 |= r9
-                    else:
-                        break
-
-            if (outIndex + r7) > outSize:
-                r7 = outSize - outIndex
-                r7 &= 0xFFFF
-
-            r9 = r10 + 1
-            r8 = outIndex  # offset into outData
-            r10 = r9 & 0xFFFF
+        entry = distTable[(bitbuf >> (bitcnt - distBits)) & ((1 << distBits) - 1)]
+        bitcnt -= entry & 0x7F
+        r11 = entry >> 8
+
+        if not entry & 0x80:
+            node = r11
             while True:
-                r9 = r7 & 0xFFFF
-                r7 -= 1
-                if r9:
-                    r9 = outIndex - r10
-                    outIndex += 1
-                    outData[r8] = outData[r9]
-                    r8 += 1
-                else:
+                if not bitcnt:
+                    bitbuf = inData[pos] if pos < end else 0
+                    bitcnt = 8
+                    pos += 1
+
+                bitcnt -= 1
+                bit = (bitbuf >> bitcnt) & 1
+                if node + 1 >= 0x80:
+                    return -1
+
+                r12 = (buf2[node] << 8) | buf2[node + 1]
+                child = (node & ~3) + ((bit + (((r12 & 7) + 1) << 1)) << 1)
+                if r12 & (0x10 >> bit):
+                    if child + 1 >= 0x80:
+                        return -1
+
+                    r11 = (buf2[child] << 8) | buf2[child + 1]
                     break
 
-        return bytes(<u8[:outSize]>outData)
+                node = child
+
+        r10 = 0
+        if r11:
+            # r11 - 1 extra bits follow, the distance is only 16 bits wide
+            r10 = 1
+            r11 -= 1
+            while r11:
+                n = r11 if r11 < 16 else 16
+                while bitcnt < n:
+                    bitbuf = (bitbuf << 8) | (inData[pos] if pos < end else 0)
+                    bitcnt += 8
+                    pos += 1
+
+                bitcnt -= n
+                r10 = ((r10 << n) | ((bitbuf >> bitcnt) & ((1 << n) - 1))) & 0xFFFF
+                r11 -= n
+
+        if (outIndex + r7) > outSize:
+            r7 = outSize - outIndex
+
+        r10 = (r10 + 1) & 0xFFFF
+        if r10 > outIndex:
+            return -1
+
+        # Byte by byte, the source may overlap with the destination
+        r9 = outIndex - r10
+        for i in range(r7):
+            outData[outIndex + i] = outData[r9 + i]
+
+        outIndex += r7
+
+    if pos > end and ((pos - end) << 3) > bitcnt:
+        return -1
 
-    finally:
-        free(context.buf1)
-        free(context.buf2)
-        free(outData)
+    return 0
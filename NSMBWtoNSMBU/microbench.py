@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Micro-benchmarks of the codecs, on fixed inputs.
+# Results can be saved to a JSON baseline and compared against it later.
+
+import archive
+import argparse
+import corpus
+import fnmatch
+import json
+import lh
+import os
+import platform
+import struct
+import sys
+import timeit
+
+BASELINE_VERSION = 1
+
+BG_RELATED = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'BG related')
+
+
+def ImportBGRelated():
+    """
+    Returns the aamp and camera_ modules from the BG related folder, or None for missing ones
+    """
+    for path in (BG_RELATED, os.path.join(BG_RELATED, 'AAMP')):
+        if path not in sys.path:
+            sys.path.append(path)
+
+    modules = []
+    for name in ('aamp', 'camera_'):
+        try:
+            modules.append(__import__(name))
+
+        except ImportError:
+            modules.append(None)
+
+    return modules
+
+
+def ImportLHCython():
+    """
+    Returns the Cython LH module, or None if it can't be built
+    """
+    try:
+        import pyximport
+        pyximport.install()
+        import lh_cy
+
+    except ImportError:
+        return None
+
+    return lh_cy
+
+
+def MakeAAMP(aamp, lists=8, objs=8, params=8):
+    """
+    Returns an AAMPFile with lists of objects holding params of every type
+    """
+    types = (aamp.ParamType.BOOL, aamp.ParamType.FLOAT, aamp.ParamType.INT, aamp.ParamType.VEC2,
+             aamp.ParamType.VEC3, aamp.ParamType.VEC4, aamp.ParamType.COLOR, aamp.ParamType.STRING32)
+    values = {
+        aamp.ParamType.BOOL: lambda i: bool(i & 1),
+        aamp.ParamType.FLOAT: lambda i: i * 0.5,
+        aamp.ParamType.INT: lambda i: i,
+        aamp.ParamType.VEC2: lambda i: aamp.Vec2.new(),
+        aamp.ParamType.VEC3: lambda i: aamp.Vec3.new(),
+        aamp.ParamType.VEC4: lambda i: aamp.Vec4.new(),
+        aamp.ParamType.COLOR: lambda i: aamp.Color.new(),
+        aamp.ParamType.STRING32: lambda i: 'param%d' % i,
+    }
+
+    file = aamp.AAMPFile.new()
+    for i in range(lists):
+        paramList = aamp.ParamList.new()
+        paramList.name_hash = i
+        for j in range(objs):
+            obj = aamp.ParamObj.new()
+            obj.name_hash = j
+            for k in range(params):
+                param = aamp.Param.new()
+                param.type = types[k % len(types)]
+                param.name_hash = k
+                param.value = values[param.type](k)
+                obj.params.append(param)
+
+            paramList.objs.append(obj)
+
+        file.param_root.lists.append(paramList)
+
+    return file
+
+
+def MakeCases():
+    """
+    Returns a list of (name, function) to benchmark, with their inputs already made
+    """
+    cases = []
+
+    # Codecs of the converter
+    level = corpus.MakeLevel(0, **corpus.TIERS['medium'])
+    lhData = lh.CompressLH(level, 1)
+    cases.append(('lh.UncompressLH', lambda: lh.UncompressLH(lhData)))
+
+    lh_cy = ImportLHCython()
+    if lh_cy is not None:
+        cases.append(('lh_cy.UncompressLH', lambda: lh_cy.UncompressLH(lhData)))
+
+    arc = archive.U8.load(level)
+    cases.append(('U8._load', lambda: archive.U8()._load(level)))
+    cases.append(('U8._dump', arc._dump))
+
+    nodeData = struct.pack('>HHII', 0x0100, 12, 0, 34)
+    node = archive.U8.U8Node()
+    node.unpack(nodeData)
+    compiled = archive.U8.U8Node.compile()
+    record = compiled.unpack(nodeData)
+    cases.append(('Struct.unpack', lambda: archive.U8.U8Node().unpack(nodeData)))
+    cases.append(('Struct.pack', node.pack))
+    cases.append(('CompiledStruct.unpack', lambda: compiled.unpack(nodeData)))
+    cases.append(('CompiledStruct.pack', lambda: compiled.pack(record)))
+
+    # Codecs of the BG related scripts
+    aamp, camera_ = ImportBGRelated()
+    if aamp is not None:
+        aampFile = MakeAAMP(aamp)
+        aampData = aampFile.to_data()
+        cases.append(('aamp.from_data', lambda: aamp.AAMPFile.from_data(aampData)))
+        cases.append(('aamp.lazy_lookup', lambda: aamp.AAMPFile.from_data(aampData, lazy=True).param_root.get_list(3)
+                                                  .get_obj(4).get_param(2).value))
+        cases.append(('aamp.to_data', aampFile.to_data))
+
+    if camera_ is not None:
+        fields = {('camera_param_%02d' % i).encode('ascii'): (4, i * 0.25) for i in range(64)}
+        cameraData = camera_.save(fields)
+        cases.append(('camera_.read', lambda: camera_.read(cameraData)))
+        cases.append(('camera_.save', lambda: camera_.save(fields)))
+
+    return cases
+
+
+def TimeCase(func, repeat=5):
+    """
+    Returns the best time of one call to func, in seconds
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def RunSuite(patterns=None, repeat=5, log=print):
+    """
+    Runs the cases whose names match one of patterns (fnmatch style), or all of them.
+    Returns a dict of case name to seconds per call.
+    """
+    results = {}
+    for name, func in MakeCases():
+        if patterns and not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+            continue
+
+        results[name] = TimeCase(func, repeat)
+        log('%-24s %12.2fus' % (name, results[name] * 1e6))
+
+    return results
+
+
+def SaveBaseline(path, results):
+    """
+    Writes results to the JSON baseline file at path
+    """
+    baseline = {
+        'version': BASELINE_VERSION,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    with open(path, 'w') as out:
+        json.dump(baseline, out, indent=2, sort_keys=True)
+
+
+def LoadBaseline(path):
+    """
+    Returns the results saved in the JSON baseline file at path
+    """
+    with open(path) as inf:
+        baseline = json.load(inf)
+
+    if baseline.get('version') != BASELINE_VERSION:
+        raise ValueError('Unsupported baseline version: %r' % baseline.get('version'))
+
+    return baseline['results']
+
+
+def Compare(baseline, results, threshold=0.1):
+    """
+    Compares results to baseline, both dicts of case name to seconds per call.
+    Returns a list of (name, old, new, change) for the cases in both,
+    and the names of the cases that got slower by more than threshold (0.1 = 10%).
+    """
+    rows = []
+    slower = []
+    for name in results:
+        if name not in baseline:
+            continue
+
+        old = baseline[name]
+        new = results[name]
+        change = new / old - 1 if old else 0.0
+        rows.append((name, old, new, change))
+
+        if change > threshold:
+            slower.append(name)
+
+    return rows, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the codecs on fixed inputs.')
+    parser.add_argument('patterns', nargs='*', help='only run the cases matching these patterns, e.g. "lh*"')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timing runs per case, the best is kept (default: 5)')
+    parser.add_argument('--save', metavar='FILE', help='write the results to a JSON baseline file')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results to a JSON baseline file')
+    parser.add_argument('--threshold', type=float, default=10, metavar='PERCENT',
+                        help='slowdown that counts as a regression when comparing (default: 10)')
+    args = parser.parse_args(argv)
+
+    # Load the baseline first, so a bad file fails before the benchmarks run
+    baseline = None if args.compare is None else LoadBaseline(args.compare)
+
+    results = RunSuite(args.patterns, args.repeat)
+
+    if args.save is not None:
+        SaveBaseline(args.save, results)
+
+    if baseline is None:
+        return 0
+
+    rows, slower = Compare(baseline, results, args.threshold / 100)
+
+    print('-' * 80)
+    for name, old, new, change in rows:
+        print('%-24s %12.2fus %12.2fus %+8.1f%%%s' % (name, old * 1e6, new * 1e6, change * 100,
+                                                   '  SLOWER' if name in slower else ''))
+
+    if slower:
+        print('%d of %d cases got slower than the baseline by more than %g%%' % (len(slower), len(rows), args.threshold))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Columnar object layers, backed by NumPy structured arrays.
+# NumPy is optional: check AVAILABLE before making an ObjectLayer.
+
+import struct
+
+try:
+    import numpy as np
+
+except ImportError:
+    np = None
+
+AVAILABLE = np is not None
+
+if AVAILABLE:
+    # Object record in the NSMBW layer files, 10 bytes
+    NSMBW_OBJECT = np.dtype([
+        ('type', '>u2'),  # tileset << 12 | type
+        ('x', '>u2'),
+        ('y', '>u2'),
+        ('width', '>u2'),
+        ('height', '>u2'),
+    ])
+
+    # Object record in the NSMBU layer files, 16 bytes
+    NSMBU_OBJECT = np.dtype({
+        'names': ['type', 'x', 'y', 'width', 'height', 'data'],
+        'formats': ['>u2', '>i2', '>i2', '>u2', '>u2', 'u1'],
+        'offsets': [0, 2, 4, 6, 8, 10],
+        'itemsize': 16,
+    })
+
+    # What we keep in memory, one column per ObjectItem attribute
+    OBJECT = np.dtype([
+        ('tileset', 'u1'),
+        ('type', 'u2'),
+        ('original_type', 'u2'),
+        ('objx', 'i4'),
+        ('objy', 'i4'),
+        ('width', 'u2'),
+        ('height', 'u2'),
+        ('data', 'u1'),
+    ])
+
+
+class ObjectView:
+    """
+    ObjectItem-like view of one object of an ObjectLayer.
+    Setting attributes writes to the layer.
+    """
+    __slots__ = ('_objects', '_index', 'layer')
+
+    def __init__(self, objects, index, layer):
+        self._objects = objects
+        self._index = index
+        self.layer = layer
+
+
+def _viewProperty(name):
+    def get(self):
+        return int(self._objects[name][self._index])
+
+    def set(self, value):
+        self._objects[name][self._index] = value
+
+    return property(get, set)
+
+
+for _name in ('tileset', 'type', 'original_type', 'objx', 'objy', 'width', 'height', 'data'):
+    setattr(ObjectView, _name, _viewProperty(_name))
+
+del _name
+
+
+def _checkRange(values, format):
+    """
+    Raises the struct.error packing values with the struct format would,
+    if any of them doesn't fit it
+    """
+    if not len(values):
+        return
+
+    low, high = (-0x8000, 0x7FFF) if format == 'h' else (0, 0xFFFF)
+    if values.min() < low or values.max() > high:
+        raise struct.error("'%s' format requires %d <= number <= %d" % (format, low, high))
+
+
+class ObjectLayer:
+    """
+    Object layer stored as one structured array, instead of an ObjectItem per object.
+    Iterating over it or indexing it gives ObjectViews.
+    """
+
+    def __init__(self, idx, objects=None):
+        """
+        Creates a layer with the given OBJECT array, or an empty one
+        """
+        if not AVAILABLE:
+            raise ImportError('ObjectLayer needs NumPy')
+
+        self.idx = idx
+        self.objects = np.zeros(0, OBJECT) if objects is None else objects
+
+    @classmethod
+    def loadNSMBW(cls, idx, layerdata):
+        """
+        Loads a layer from the contents of a NSMBW layer file
+        """
+        raw = np.frombuffer(layerdata, NSMBW_OBJECT, len(layerdata) // NSMBW_OBJECT.itemsize)
+
+        objects = np.zeros(len(raw), OBJECT)
+        objects['tileset'] = raw['type'] >> 12
+        objects['type'] = objects['original_type'] = raw['type'] & 4095
+        objects['objx'] = raw['x']
+        objects['objy'] = raw['y']
+        objects['width'] = raw['width']
+        objects['height'] = raw['height']
+
+        return cls(idx, objects)
+
+    def saveNSMBU(self):
+        """
+        Returns the contents of a NSMBU layer file for this layer
+        """
+        objects = self.objects
+
+        # Fail like the ObjectItem layers do, instead of wrapping around
+        types = (objects['tileset'].astype('i4') << 12) | objects['type']
+        _checkRange(types, 'H')
+        _checkRange(objects['objx'], 'h')
+        _checkRange(objects['objy'], 'h')
+
+        # Fill the records in place, in front of the terminator
+        buffer = bytearray((len(objects) * NSMBU_OBJECT.itemsize) + 2)
+        out = np.frombuffer(buffer, NSMBU_OBJECT, len(objects))
+        out['type'] = types
+        out['x'] = objects['objx']
+        out['y'] = objects['objy']
+        out['width'] = objects['width']
+        out['height'] = objects['height']
+        out['data'] = objects['data']
+
+        buffer[-2:] = b'\xFF\xFF'
+        return buffer
+
+    def remapTypes(self, tileset, table, default=0):
+        """
+        Replaces the types of the objects from tileset using the dict table.
+        Types missing from table become default.
+        """
+        lut = np.full(4096, default, 'u2')
+        for old, new in table.items():
+            lut[old] = new
+
+        mask = self.objects['tileset'] == tileset
+        self.objects['type'][mask] = lut[self.objects['type'][mask]]
+
+    def moveTypes(self, tileset, newTileset, below, offset):
+        """
+        Moves the objects from tileset with a type below the given one
+        to newTileset, adding offset to their type
+        """
+        mask = (self.objects['tileset'] == tileset) & (self.objects['type'] < below)
+        self.objects['tileset'][mask] = newTileset
+        self.objects['type'][mask] += offset
+
+    def setData(self, value):
+        """
+        Sets the data of every object to value
+        """
+        self.objects['data'] = value
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.objects)
+
+        if not 0 <= index < len(self.objects):
+            raise IndexError('object index out of range')
+
+        return ObjectView(self.objects, index, self.idx)
+
+    def __iter__(self):
+        for i in range(len(self.objects)):
+            yield ObjectView(self.objects, i, self.idx)
+
+    def copy(self):
+        return ObjectLayer(self.idx, self.objects.copy())
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Tests of the U8 archive index
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import archive
+
+
+def MakeArchive():
+    arc = archive.U8()
+    arc['course'] = None
+    arc['course/sub'] = None
+    arc['course/sub/x.bin'] = b'x'
+    arc['course/f.bin'] = b'f'
+    return arc
+
+
+class TestSetItem(unittest.TestCase):
+    def assertIndexed(self, arc):
+        """
+        Checks the index of arc against the one of the same archive loaded back
+        """
+        loaded = archive.U8.load(arc._dump())
+        self.assertEqual(loaded.files, arc.files)
+        self.assertEqual(loaded._index, arc._index)
+        self.assertEqual(loaded._descendants, arc._descendants)
+
+    def testDirToFile(self):
+        arc = MakeArchive()
+        arc['course/sub'] = b'sub'
+
+        self.assertEqual(arc['course'], ['sub', 'f.bin'])
+        self.assertEqual(arc['course/sub'], b'sub')
+        self.assertNotIn('course/sub/x.bin', arc._index)
+        self.assertIndexed(arc)
+
+    def testFileToDir(self):
+        arc = MakeArchive()
+        arc['course/f.bin'] = None
+        self.assertEqual(arc['course/f.bin'], [])
+
+        arc['course/f.bin/y.bin'] = b'y'
+        self.assertEqual(arc['course'], ['sub', 'sub/x.bin', 'f.bin', 'f.bin/y.bin'])
+        self.assertEqual(arc['course/f.bin'], ['y.bin'])
+        self.assertIndexed(arc)
+
+    def testReplaceFile(self):
+        arc = MakeArchive()
+        arc['course/sub/x.bin'] = b'new'
+
+        self.assertEqual(arc['course/sub/x.bin'], b'new')
+        self.assertEqual(arc['course'], ['sub', 'sub/x.bin', 'f.bin'])
+        self.assertIndexed(arc)
+
+
+if __name__ == '__main__':
+    unittest.main()
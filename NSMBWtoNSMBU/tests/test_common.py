@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Tests of CompiledStruct against the Struct it is compiled from
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from common import CompiledStruct, Struct, StructException
+
+
+class Header(Struct):
+    __endian__ = Struct.BE
+
+    def __format__(self):
+        self.tag = Struct.string(4, offset=2)
+        self.count = Struct.uint16
+        self.name = Struct.string(8, encoding='latin-1', stripNulls=True)
+        self.raw = Struct.string(3, encoding='latin-1')
+        self.scale = Struct.float
+
+
+# Names ending with nulls, backslashes and zeroes, which Struct strips alike
+DATA = [struct.pack('>4sH8s3sf', *values) for values in (
+    (b'Uaa8', 3, b'name', b'xyz', 1.0),
+    (b'\0\0\0\0', 0xFFFF, b'a0\\0', b'', 0.0),
+    (b'ABCD', 0x1234, b'\xe9t\xe9', b'\0\0\xff', -2.5),
+)]
+
+
+class TestCompiledStruct(unittest.TestCase):
+    def testSize(self):
+        self.assertEqual(len(Header.compile()), len(Header()))
+
+    def testUnpack(self):
+        compiled = Header.compile()
+        for data in DATA:
+            expected = Header(unpack=data)
+            record = compiled.unpack(data)
+            for name in compiled.names:
+                self.assertEqual(getattr(record, name), getattr(expected, name), name)
+
+    def testPack(self):
+        compiled = Header.compile()
+        for data in DATA:
+            self.assertEqual(compiled.pack(compiled.unpack(data)), Header(unpack=data).pack())
+
+    def testStripNullsWithoutEncoding(self):
+        class Bad(Struct):
+            def __format__(self):
+                self.name = Struct.string(4, stripNulls=True)
+
+        with self.assertRaises(StructException):
+            CompiledStruct(Bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Tests of the LH compressor and decompressors
+
+import io
+import os
+import random
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import lh
+
+rng = random.Random(0)
+INPUTS = {
+    'empty': b'',
+    'random': bytes(rng.getrandbits(8) for _ in range(5000)),
+    'repetitive': b'\0' * 20000 + b'NSMB' * 3000,
+    'text': b'The quick brown fox jumps over the lazy dog. ' * 200,
+}
+
+
+class TestRoundTrip(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.compressed = {(name, level): lh.CompressLH(data, level)
+                          for name, data in INPUTS.items() for level in range(10)}
+
+    def testUncompressLH(self):
+        for (name, level), data in self.compressed.items():
+            for tables in (True, False):
+                with self.subTest(input=name, level=level, tables=tables):
+                    self.assertTrue(lh.IsLHCompressed(data))
+                    self.assertEqual(lh.GetUncompressedSize(data), len(INPUTS[name]))
+                    self.assertEqual(lh.UncompressLH(data, tables), INPUTS[name])
+
+    def testDecompressor(self):
+        for (name, level), data in self.compressed.items():
+            for size in (1, 13, len(data) or 1):
+                with self.subTest(input=name, level=level, chunk=size):
+                    decompressor = lh.LHDecompressor()
+                    out = b''.join(decompressor.decompress(chunk) for chunk in Chunks(data, size))
+                    decompressor.finish()
+                    self.assertEqual(out, INPUTS[name])
+
+    def testUncompressLHInto(self):
+        for (name, level), data in self.compressed.items():
+            with self.subTest(input=name, level=level):
+                out = bytearray(len(INPUTS[name]) + 5)
+                self.assertEqual(lh.UncompressLHInto(data, out), len(INPUTS[name]))
+                self.assertEqual(bytes(out[:len(INPUTS[name])]), INPUTS[name])
+
+    def testIterUncompressLH(self):
+        for (name, level), data in self.compressed.items():
+            with self.subTest(input=name, level=level):
+                out = b''.join(lh.IterUncompressLH(io.BytesIO(data), 100))
+                self.assertEqual(out, INPUTS[name])
+
+    def testBadLevel(self):
+        self.assertRaises(ValueError, lh.CompressLH, b'abc', 10)
+
+    def testTruncated(self):
+        data = self.compressed['text', 6]
+        decompressor = lh.LHDecompressor()
+        decompressor.decompress(data[:len(data) // 2])
+        self.assertRaises(IndexError, decompressor.finish)
+
+
+def Chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestInterleaved(unittest.TestCase):
+    def testDecompressors(self):
+        rng = random.Random(1)
+        inputs = [bytes(rng.getrandbits(8) for _ in range(3000)), b'abcabcabd' * 500]
+        datas = [lh.CompressLH(data, 6) for data in inputs]
+
+        decompressors = [lh.LHDecompressor(), lh.LHDecompressor()]
+        outputs = [[], []]
+        chunks = [Chunks(data, 7) for data in datas]
+        for i in range(max(map(len, chunks))):
+            for j in range(2):
+                if i < len(chunks[j]):
+                    outputs[j].append(decompressors[j].decompress(chunks[j][i]))
+
+        for j in range(2):
+            decompressors[j].finish()
+            self.assertEqual(b''.join(outputs[j]), inputs[j])
+
+    def testThreads(self):
+        rng = random.Random(2)
+        inputs = [bytes(rng.getrandbits(8) for _ in range(2000)), b'xyz' * 2000, bytes(range(256)) * 8]
+        datas = [lh.CompressLH(data, 4) for data in inputs]
+        errors = []
+
+        def Run(j):
+            try:
+                for i in range(20):
+                    self.assertEqual(lh.UncompressLH(datas[j], i & 1 == 0), inputs[j])
+
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=Run, args=(j,)) for j in range(len(datas))]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: latin-1 -*-
+
+# Yaz0 (SZS) compression, as used by the files of NSMBU
+
+from concurrent.futures import ProcessPoolExecutor
+from common import LZTokens
+import struct
+
+YAZ0_HEADER = struct.Struct('>4sI8x')
+
+# Compression levels: (hash chain length, nice match length, lazy matching)
+YAZ0_LEVELS = (
+    (0, 0, False),
+    (4, 16, False),
+    (8, 32, False),
+    (16, 64, False),
+    (16, 32, True),
+    (32, 128, True),
+    (128, 0x111, True),
+    (256, 0x111, True),
+    (1024, 0x111, True),
+    (4096, 0x111, True),
+)
+
+YAZ0_MAX_MATCH = 0xFF + 0x12
+YAZ0_MAX_DISTANCE = 0x1000
+
+
+def IsYaz0Compressed(inData):
+    return inData[:4] == b'Yaz0'
+
+
+def GetYaz0UncompressedSize(inData):
+    return YAZ0_HEADER.unpack_from(inData)[1]
+
+
+def UncompressYaz0(inData):
+    """
+    Decompresses Yaz0 data
+    """
+    if not IsYaz0Compressed(inData):
+        raise ValueError('Not Yaz0 data')
+
+    data = bytes(inData)
+    outSize = GetYaz0UncompressedSize(data)
+    out = bytearray(outSize)
+    src = YAZ0_HEADER.size
+    dst = 0
+
+    while dst < outSize:
+        code = data[src]
+        src += 1
+
+        for _ in range(8):
+            if code & 0x80:
+                out[dst] = data[src]
+                src += 1
+                dst += 1
+
+            else:
+                b1 = data[src]
+                b2 = data[src + 1]
+                src += 2
+
+                copy = dst - (((b1 & 0xF) << 8) | b2) - 1
+                if copy < 0:
+                    raise IndexError('Yaz0 data is corrupted')
+
+                length = b1 >> 4
+                if length:
+                    length += 2
+
+                else:
+                    length = data[src] + 0x12
+                    src += 1
+
+                length = min(length, outSize - dst)
+                if dst - copy >= length:
+                    out[dst:dst + length] = out[copy:copy + length]
+
+                else:
+                    # The match overlaps its own output, so repeat what's there
+                    pattern = out[copy:dst]
+                    out[dst:dst + length] = (pattern * (length // len(pattern) + 1))[:length]
+
+                dst += length
+
+            if dst >= outSize:
+                break
+
+            code <<= 1
+
+    return bytes(out)
+
+
+def CompressYaz0(inData, level=6):
+    """
+    Compresses data to Yaz0.
+    Level 0 only stores literals, levels 1 to 9 trade speed for ratio.
+    """
+    if not 0 <= level < len(YAZ0_LEVELS):
+        raise ValueError('Yaz0 compression level must be between 0 and %d' % (len(YAZ0_LEVELS) - 1))
+
+    maxChain, niceLength, lazy = YAZ0_LEVELS[level]
+
+    data = bytes(inData)
+    tokens = LZTokens(data, maxChain, niceLength, lazy, YAZ0_MAX_MATCH, YAZ0_MAX_DISTANCE)
+
+    out = bytearray(YAZ0_HEADER.pack(b'Yaz0', len(data)))
+    append = out.append
+
+    # Every group of 8 tokens starts with a byte of flags, 1 for literals
+    for i in range(0, len(tokens), 8):
+        group = tokens[i:i + 8]
+        flagsPos = len(out)
+        append(0)
+
+        flags = 0
+        bit = 0x80
+        for token in group:
+            if token.__class__ is int:
+                flags |= bit
+                append(token)
+
+            else:
+                length, distance = token
+                distance -= 1
+                if length >= 0x12:
+                    append(distance >> 8)
+                    append(distance & 0xFF)
+                    append(length - 0x12)
+
+                else:
+                    append(((length - 2) << 4) | (distance >> 8))
+                    append(distance & 0xFF)
+
+            bit >>= 1
+
+        out[flagsPos] = flags
+
+    return bytes(out)
+
+
+def CompressYaz0Many(datas, level=6, workers=None):
+    """
+    Compresses a list of data to Yaz0 on a pool of processes.
+    Returns the results in the same order.
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(CompressYaz0, datas, [level] * len(datas)))